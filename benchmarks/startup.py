@@ -0,0 +1,164 @@
+"""
+Startup time of every manage.py subcommand.
+
+    python benchmarks/startup.py --runs 20 --budget 0.1
+
+Each command runs against a throwaway context with a few boxes, the median
+wall time is compared with the previous run stored in results/startup.jsonl
+and appended to it, so regressions can be tracked commit by commit.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LOC_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+LOC_MANAGE = os.path.join(os.path.dirname(LOC_BENCHMARKS), 'manage.py')
+LOC_RESULTS = os.path.join(LOC_BENCHMARKS, 'results', 'startup.jsonl')
+
+COMMANDS = [
+    ['--help'],
+    ['setup', '--help'],
+    ['create', '--help'],
+    ['remove', '--help'],
+    ['sync', '--help'],
+    ['starter', '--help'],
+    ['retrieve'],
+    ['retrieve', '--name', 'box0'],
+]
+
+SETTINGS = """[contexts]
+location = {location}
+pipeline = localhost
+
+[containers]
+location = containers
+boxes = containers/boxes
+
+[repositories]
+location = repositories
+token =
+
+[profiles]
+location = profiles
+repository =
+
+[environments]
+location = environments
+repository =
+"""
+
+
+def build_context(location, boxes):
+    """
+    :param location: temporary folder
+    :param boxes: number of boxes to generate
+    :return: path of settings.ini
+    """
+    loc_boxes = os.path.join(location, 'containers', 'boxes')
+    os.makedirs(loc_boxes)
+    for number in range(boxes):
+        name = 'box{0}'.format(number)
+        with open(os.path.join(loc_boxes, name + '.json'), 'w') as outfile:
+            json.dump({
+                '_id': number + 1,
+                'sandbox': {
+                    'name': name,
+                    'profile': 'profiles/profile_[{0}]'.format(name),
+                    'environment': 'environments/{0}.yml'.format(name),
+                    'repository': 'https://github.com/lmokto/{0}.git'.format(name),
+                    'location': 'repositories/{0}'.format(name),
+                    'version': '1.0.0',
+                    'language': 'python3.6'
+                }
+            }, outfile)
+    settings = os.path.join(location, 'settings.ini')
+    with open(settings, 'w') as outfile:
+        outfile.write(SETTINGS.format(location=location))
+    return settings
+
+
+def measure(command, runs, env):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, LOC_MANAGE] + command, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def previous_results():
+    if not os.path.isfile(LOC_RESULTS):
+        return {}
+    with open(LOC_RESULTS, 'r') as infile:
+        lines = [line for line in infile if line.strip()]
+    return json.loads(lines[-1])['results'] if lines else {}
+
+
+def revision():
+    response = subprocess.run(
+        ['git', 'rev-parse', '--short', 'HEAD'], cwd=LOC_BENCHMARKS,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    return response.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--runs', type=int, default=10, help='runs per command')
+    parser.add_argument('-b', '--boxes', type=int, default=50, help='boxes in the context')
+    parser.add_argument('--budget', type=float, default=None, help='fail when a median exceeds it (seconds)')
+    parser.add_argument('--no-save', action='store_true', help='do not append to results')
+    args = parser.parse_args()
+
+    previous = previous_results()
+    results = {}
+    with tempfile.TemporaryDirectory() as location:
+        env = dict(os.environ, LOC_SETTINGS=build_context(location, args.boxes))
+        # warm up the index and the interpreter caches
+        measure(['retrieve'], 1, env)
+        for command in COMMANDS:
+            key = ' '.join(command)
+            timings = measure(command, args.runs, env)
+            results[key] = {
+                'median': statistics.median(timings),
+                'min': min(timings),
+                'max': max(timings)
+            }
+
+    print('{0:<28} {1:>10} {2:>10} {3:>10}'.format('command', 'median', 'min', 'delta'))
+    for key, result in results.items():
+        before = previous.get(key, {}).get('median')
+        delta = '{0:+.1f}ms'.format((result['median'] - before) * 1000) if before else '-'
+        print('{0:<28} {1:>8.1f}ms {2:>8.1f}ms {3:>10}'.format(
+            key, result['median'] * 1000, result['min'] * 1000, delta
+        ))
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(LOC_RESULTS), exist_ok=True)
+        with open(LOC_RESULTS, 'a') as outfile:
+            outfile.write(json.dumps({
+                'time': time.time(),
+                'revision': revision(),
+                'python': sys.version.split()[0],
+                'runs': args.runs,
+                'boxes': args.boxes,
+                'results': results
+            }) + '\n')
+
+    if args.budget is not None:
+        slow = [k for k, r in results.items() if r['median'] > args.budget]
+        if slow:
+            print('over budget: {0}'.format(', '.join(slow)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+Latency and memory of the subcommands and of ManagerContext with stub
+conda, git, ipython, pip and npm executables.
+
+    python benchmarks/suite.py --sizes 10,1000,100000 --runs 5 --latency 0.05
+
+benchmarks/stubs goes first on PATH and LOC_CONDA points to its conda, pip
+resolves with the stub pip and its wheels come from file:// urls, every
+stub sleeps STUB_LATENCY seconds per call so the time spent in manage.py can
+be told apart from the time of the tools. create talks to a local stand-in of
+the GitHub API over keep-alive connections. For every registry size a throwaway context with that many
+boxes is generated, the medians are compared with the previous run stored in
+results/suite.jsonl and appended to it.
+"""
+import argparse
+import http.server
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from startup import LOC_BENCHMARKS, LOC_MANAGE, revision
+
+LOC_STUBS = os.path.join(LOC_BENCHMARKS, 'stubs')
+LOC_RESULTS = os.path.join(LOC_BENCHMARKS, 'results', 'suite.jsonl')
+
+# (name, argv of the run number), run in this order so sync comes before
+# sync --name and remove
+COMMANDS = [
+    ('retrieve', lambda n: ['retrieve']),
+    ('retrieve --name', lambda n: ['retrieve', '--name', 'box0']),
+    ('retrieve --format jsonl', lambda n: ['retrieve', '--format', 'jsonl']),
+    ('retrieve --where', lambda n: [
+        'retrieve', '--where', 'language=nodejs', '--fields', 'name', '--format', 'jsonl'
+    ]),
+    ('create', lambda n: ['create', '--name', 'bench{0}'.format(n), '--language', 'python3.6']),
+    ('sync', lambda n: [
+        'sync', '--repository', 'https://github.com/bench/sync{0}.git'.format(n),
+        '--environment', 'sync{0}'.format(n), '--language', 'python3.6'
+    ]),
+    ('sync --name', lambda n: ['sync', '--name', 'sync{0}'.format(n)]),
+    ('sync nodejs', lambda n: [
+        'sync', '--repository', 'https://github.com/bench/node{0}.git'.format(n),
+        '--environment', 'node{0}'.format(n), '--language', 'nodejs'
+    ]),
+    ('remove', lambda n: ['remove', '--name', 'sync{0}'.format(n), '--wait']),
+]
+
+SETTINGS = """[contexts]
+location = {location}
+pipeline = localhost
+
+[containers]
+location = containers
+boxes = containers/boxes
+
+[repositories]
+location = repositories
+token = bench
+api = {api}
+interval = 0
+
+[profiles]
+location = profiles
+repository =
+
+[environments]
+location = environments
+repository =
+prefix = {location}/conda/envs
+
+[pool]
+size = 0
+
+[wheelhouse]
+pip = pip
+"""
+
+
+class GithubStub(http.server.BaseHTTPRequestHandler):
+    """
+    GET /user and POST /user/repos of the GitHub API with ETag and
+    X-RateLimit headers, a GET with a matching If-None-Match answers 304
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def answer(self, status, data, etag=None):
+        content = json.dumps(data).encode('utf8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/user'):
+            etag = '"bench-user"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.answer(304, None, etag)
+            return self.answer(200, {'login': 'bench', 'id': 1}, etag)
+        self.answer(404, {'message': 'Not Found'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'] or 0)) or '{}')
+        name = body.get('name', 'repository')
+        self.answer(201, {
+            'id': abs(hash(name)),
+            'name': name,
+            'full_name': 'bench/' + name,
+            'url': 'http://{0}:{1}/repos/bench/{2}'.format(*self.server.server_address, name),
+            'clone_url': 'https://github.com/bench/{0}.git'.format(name)
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+def build_context(location, boxes, api):
+    """
+    :param location: temporary folder
+    :param boxes: number of boxes to generate
+    :param api: url of the GitHub stub
+    :return: environment variables of the commands
+    """
+    loc_boxes = os.path.join(location, 'containers', 'boxes')
+    for folder in (loc_boxes, 'profiles', 'environments', 'repositories', 'conda/envs', 'conda/condabin'):
+        os.makedirs(os.path.join(location, folder), exist_ok=True)
+    for number in range(boxes):
+        name = 'box{0}'.format(number)
+        with open(os.path.join(loc_boxes, name + '.json'), 'w') as outfile:
+            json.dump({
+                '_id': number + 1,
+                'sandbox': {
+                    'name': name,
+                    'profile': 'profiles/profile_[{0}]'.format(name),
+                    'environment': 'environments/{0}.yml'.format(name),
+                    'repository': 'https://github.com/bench/{0}.git'.format(name),
+                    'location': 'repositories/{0}'.format(name),
+                    'version': '1.0.{0}'.format(number % 10),
+                    'language': 'nodejs' if number % 4 == 0 else 'python3.6'
+                }
+            }, outfile)
+    settings = os.path.join(location, 'settings.ini')
+    with open(settings, 'w') as outfile:
+        outfile.write(SETTINGS.format(location=location, api=api))
+    conda = os.path.join(location, 'conda', 'condabin', 'conda')
+    os.symlink(os.path.join(LOC_STUBS, 'conda'), conda)
+    return dict(
+        os.environ,
+        PATH=LOC_STUBS + os.pathsep + os.environ.get('PATH', ''),
+        LOC_SETTINGS=settings,
+        LOC_CONDA=conda,
+        LOC_DAEMON='0',
+        STUB_ENVS=os.path.join(location, 'conda', 'envs'),
+        STUB_WHEELS=os.path.join(location, 'stub-wheels')
+    )
+
+
+def measure(argv, env):
+    """
+    :return: seconds, peak rss in bytes and stderr of a failed command
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, LOC_MANAGE] + argv, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    # read stderr before waiting, a full pipe would block the command
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    error = stderr.decode('utf8', 'replace').strip().splitlines()[-1:] if process.returncode else []
+    return elapsed, usage.ru_maxrss * 1024, (error or [None])[0]
+
+
+def load_manage(env):
+    """
+    :return: a fresh manage module reading the settings of env
+    """
+    os.environ.update(LOC_SETTINGS=env['LOC_SETTINGS'], LOC_CONDA=env['LOC_CONDA'])
+    spec = importlib.util.spec_from_file_location('manage', LOC_MANAGE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def methods(module, settings):
+    """
+    :return: [(name, func)] of ManagerContext, run in this order
+    """
+    database = os.path.join(os.path.dirname(settings), 'containers', 'boxes.db')
+    context = {}
+
+    def cold():
+        if os.path.exists(database):
+            os.remove(database)
+        context['manager'] = module.ManagerContext(settings)
+        context['manager'].index.refresh()
+
+    def boxes():
+        context['boxes'] = list(context['manager'].index.sandboxes())
+
+    return [
+        ('ManagerContext()', lambda: module.ManagerContext(settings)),
+        ('index.refresh cold', cold),
+        ('index.refresh warm', lambda: context['manager'].index.refresh()),
+        ('index.sandboxes', boxes),
+        ('registry', lambda: [context['manager'].registry(b) for b in context['boxes']]),
+        ('retrieve_sandboxes', lambda: context['manager'].retrieve_sandboxes()),
+        ('get_sandbox name', lambda: [
+            context['manager'].get_sandbox('name', b['sandbox']['name']) for b in context['boxes'][:1000]
+        ]),
+        ('get_sandbox _id', lambda: [
+            context['manager'].get_sandbox('_id', b['_id']) for b in context['boxes'][:1000]
+        ]),
+        ('github.user', lambda: module.github.user()),
+        ('github.create_repos 20', lambda: module.github.create_repos(
+            ['batch{0}'.format(n) for n in range(20)]
+        )),
+    ]
+
+
+def summary(timings, memory, errors):
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'memory': max(memory),
+        'failed': len(errors),
+        'error': errors[-1] if errors else None
+    }
+
+
+def run_size(boxes, runs, api, only):
+    """
+    :return: {name: summary} of the commands and methods for a registry of boxes
+    """
+    results = {}
+    location = tempfile.mkdtemp(prefix='containers-bench-')
+    try:
+        env = build_context(location, boxes, api)
+        # warm up the index and the interpreter caches
+        measure(['retrieve', '--limit', '1'], env)
+        for name, argv in COMMANDS:
+            if only and name not in only:
+                continue
+            timings, memory, errors = [], [], []
+            for number in range(runs):
+                elapsed, rss, error = measure(argv(number), env)
+                timings.append(elapsed)
+                memory.append(rss)
+                if error:
+                    errors.append(error)
+            results[name] = summary(timings, memory, errors)
+
+        module = load_manage(env)
+        # every method runs, the later ones use what the earlier ones loaded
+        for name, func in methods(module, env['LOC_SETTINGS']):
+            timings, memory, errors = [], [], []
+            # the last run is traced for memory, tracemalloc slows the others down
+            for number in range(runs + 1):
+                if number == runs:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                try:
+                    func()
+                except Exception as Error:
+                    errors.append('{0}: {1}'.format(type(Error).__name__, Error))
+                if number < runs:
+                    timings.append(time.perf_counter() - start)
+            memory.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            if not only or name in only:
+                results[name] = summary(timings, memory, errors)
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+    return results
+
+
+def previous_results():
+    if not os.path.isfile(LOC_RESULTS):
+        return {}
+    with open(LOC_RESULTS, 'r') as infile:
+        lines = [line for line in infile if line.strip()]
+    return json.loads(lines[-1])['results'] if lines else {}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default='10,1000,10000', help='boxes of the registries, up to 100000')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='runs per command')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='seconds slept by every stub call')
+    parser.add_argument('-o', '--only', action='append', help='command or method, repeatable')
+    parser.add_argument('--no-save', action='store_true', help='do not append to results')
+    args = parser.parse_args()
+    os.environ['STUB_LATENCY'] = str(args.latency)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GithubStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = 'http://{0}:{1}'.format(*server.server_address)
+
+    previous = previous_results()
+    results = {}
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            results[str(size)] = run_size(size, args.runs, api, args.only)
+    finally:
+        server.shutdown()
+
+    print('{0:>7} {1:<24} {2:>10} {3:>10} {4:>10} {5}'.format(
+        'boxes', 'name', 'median', 'memory', 'delta', 'failed'
+    ))
+    for size, entries in results.items():
+        for name, result in entries.items():
+            before = previous.get(size, {}).get(name, {}).get('median')
+            delta = '{0:+.1f}ms'.format((result['median'] - before) * 1000) if before else '-'
+            print('{0:>7} {1:<24} {2:>8.1f}ms {3:>8.1f}M {4:>10} {5}'.format(
+                size, name, result['median'] * 1000, result['memory'] / 1024.0 ** 2, delta,
+                '{0} {1}'.format(result['failed'], result['error']) if result['failed'] else ''
+            ).rstrip())
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(LOC_RESULTS), exist_ok=True)
+        with open(LOC_RESULTS, 'a') as outfile:
+            outfile.write(json.dumps({
+                'time': time.time(),
+                'revision': revision(),
+                'python': sys.version.split()[0],
+                'runs': args.runs,
+                'latency': args.latency,
+                'results': results
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
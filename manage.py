@@ -1,17 +1,20 @@
 import argparse
+import collections
+import contextlib
+import contextvars
+import functools
+import itertools
 import sys
 import os
-import fabric
 import random
 import json
 import io
-import yaml
+import shlex
 import shutil
+import sqlite3
 import subprocess
-from github import Github
-
-import validators
-from invoke import UnexpectedExit
+import threading
+import time
 
 from configparser import ConfigParser
 
@@ -29,9 +32,6 @@ LOC_INSTALLER = {
 }
 
 
-# from sqlalchemy.orm import sessionmaker
-# from sqlalchemy import create_engine
-
 # export LOC_CONTAINERS=/Users/$(whoami)/Documents/lmokto/containers
 # LOC_CONTAINERS = os.environ.get('LOC_CONTAINERS')
 
@@ -62,23 +62,156 @@ class AttrDict(dict):
         self.__dict__ = self
 
 
+class Tracer(object):
+    """
+    Timing spans of the steps, appended as json lines to
+    <containers>/traces.jsonl and kept in memory for --trace
+    """
+    labels = contextvars.ContextVar('labels', default={})
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """
+        New run id and no spans, once per process or per command of the daemon
+        """
+        self.run = '{0:x}-{1}'.format(int(time.time() * 1000), os.getpid())
+        self.spans = []
+
+    @property
+    def filename(self):
+        return os.path.join(
+            manager.location('containers'),
+            manager.settings.containers.get('traces', 'traces.jsonl')
+        )
+
+    def label(self, **labels):
+        """
+        Add labels (box, language) to the spans of the current context
+        """
+        self.labels.set(dict(self.labels.get(), **labels))
+
+    def record(self, step, start, end, response):
+        status = 'failed'
+        if isinstance(response, dict) and 'status' in response:
+            if isinstance(response['status'], str):
+                status = response['status']
+        elif response is not None and response is not False:
+            status = 'successful'
+        span = dict(self.labels.get(), **{
+            'run': self.run,
+            'step': step,
+            'start': start,
+            'duration': end - start,
+            'status': status,
+            'exited': response.get('exited') if isinstance(response, dict) else None,
+            'size': response.get('size') if isinstance(response, dict) else None
+        })
+        with self.lock:
+            self.spans.append(span)
+            with open(self.filename, 'a') as outfile:
+                outfile.write(json.dumps(span, default=str) + '\n')
+        return span
+
+    def read(self):
+        try:
+            with open(self.filename, 'r') as infile:
+                for line in infile:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def waterfall(self, width=40, out=sys.stderr):
+        if not self.spans:
+            return
+        begin = min(s['start'] for s in self.spans)
+        total = max(s['start'] + s['duration'] for s in self.spans) - begin or 1
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            offset = int((span['start'] - begin) / total * width)
+            length = max(1, int(span['duration'] / total * width))
+            out.write('{0:<16} {1:<16} {2:<{width}} {3:>8.2f}s {4}\n'.format(
+                span['step'], span.get('box', ''), ' ' * offset + '#' * length,
+                span['duration'], span['status'], width=width
+            ))
+
+
+def traced(step):
+    """
+    Record a timing span for every call of the decorated step
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start, response = time.time(), None
+            try:
+                response = func(*args, **kwargs)
+                return response
+            except UnexpectedExit as Error:
+                response = generate_response(Error.result, {})
+                raise
+            finally:
+                span = tracer.record(step, start, time.time(), response)
+                if isinstance(response, dict) and 'command' in response:
+                    response['duration'] = span['duration']
+        return wrapper
+    return decorator
+
+
+def percentile(values, percent):
+    """
+    :param values: sorted list
+    :param percent: 50, 95
+    :return: nearest rank percentile
+    """
+    import math
+    rank = max(1, int(math.ceil(percent / 100.0 * len(values))))
+    return values[rank - 1]
+
+
 class Box(object):
     attrs = [
         'name', 'profile', 'environment', 'repository',
         'location', 'version', 'language'
     ]
-    _id = random.randint(1000, 9999)
+    # hashes: content hashes of the dependency files, recorded by sync
+    # host: pipeline host which built the box
+    __slots__ = ['_id', 'hashes', 'host'] + attrs
+    issued = set()
 
     def __init__(self, instance={}):
         super().__init__()
+        self.hashes = {}
+        self.host = ''
         if instance:
             self.assignment(instance)
         else:
             [setattr(self, k, '') for k in self.attrs if k]
+            self._id = self.new_id()
+
+    @classmethod
+    def new_id(cls):
+        """
+        Random 53 bits id, never repeated in a process, ids already taken by
+        another box are rejected when the box is exported
+        """
+        _id = random.SystemRandom().getrandbits(53)
+        while _id in cls.issued or _id == 0:
+            _id = random.SystemRandom().getrandbits(53)
+        cls.issued.add(_id)
+        return _id
 
     def retrieve(self):
+        sandbox = dict((k, getattr(self, k)) for k in self.attrs)
+        if self.hashes:
+            sandbox['hashes'] = self.hashes
+        if self.host:
+            sandbox['host'] = self.host
         return {
-            'sandbox': self.__dict__,
+            'sandbox': sandbox,
             '_id': self._id
         }
 
@@ -97,12 +230,333 @@ class Box(object):
                 assert k in sandbox.keys()
                 box_attr = sandbox.get(k)
                 setattr(self, k, box_attr)
+            self.hashes = sandbox.get('hashes', {})
+            self.host = sandbox.get('host', '')
             return True
         raise ValueError('instance without id and sandbox')
 
 
 class Sandboxes(Box):
-    pass
+    __slots__ = []
+
+
+class BoxTable(object):
+    """
+    Registered boxes of the process as slotted Box records, with hash
+    indexes on _id and name
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.by_id = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return (record.retrieve() for record in self.by_id.values())
+
+    def add(self, box):
+        """
+        :param box: {'_id': ..., 'sandbox': {...}}
+        :return: failed when the id belongs to another name or the name to another id
+        """
+        record = box if isinstance(box, Box) else Box(instance=box)
+        owner = self.by_id.get(record._id)
+        existing = self.by_name.get(record.name)
+        if (owner and owner.name != record.name) or (existing and existing._id != record._id):
+            return {'status': 'failed'}
+        # same box synced again, keep the new metadata
+        self.by_id[record._id] = record
+        self.by_name[record.name] = record
+        return {'status': 'successful'}
+
+    def load(self, boxes):
+        """
+        Bulk load of boxes, every one checked against the indexes in O(1)
+        :return: names that could not be added
+        """
+        return [
+            box['sandbox']['name'] for box in boxes
+            if self.add(box)['status'] != 'successful'
+        ]
+
+    def get(self, attr, value):
+        """
+        :param attr: _id and name are hashed, other attrs are scanned
+        :return: box or {}
+        """
+        if attr == '_id':
+            record = self.by_id.get(value)
+        elif attr == 'name':
+            record = self.by_name.get(value)
+        else:
+            record = next((r for r in self.by_id.values() if getattr(r, attr) == value), None)
+        return record.retrieve() if record else {}
+
+    def discard(self, name):
+        record = self.by_name.pop(name, None)
+        if record:
+            self.by_id.pop(record._id, None)
+
+
+@contextlib.contextmanager
+def folder_lock(folder):
+    """
+    Advisory lock of a folder shared by every manage.py process
+    """
+    import fcntl
+    with open(os.path.join(folder, '.lock'), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield handle
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def write_atomic(filename, content, fsync=True):
+    """
+    Write content to a temporary file of the same folder and rename it over
+    filename, readers see the old or the new file but never a torn one
+    """
+    import tempfile
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(filename), prefix='.', suffix='.tmp'
+    )
+    try:
+        with io.open(descriptor, 'w', encoding='utf8') as out:
+            out.write(content)
+            if fsync:
+                out.flush()
+                os.fsync(out.fileno())
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return filename
+
+
+def fsync_file(filename):
+    descriptor = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def fsync_folder(folder):
+    descriptor = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class RegistrySession(object):
+    """
+    Collect boxes built by bulk commands and registry/export them together
+    at the end instead of once per box
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.boxes = []
+
+    def add(self, box):
+        self.boxes.append(box)
+
+    def commit(self):
+        responses, registered = {}, []
+        for box in self.boxes:
+            response = manager.registry(box)
+            if response['status'] == 'successful':
+                registered.append(box)
+            responses[box['sandbox']['name']] = response
+        # one lock and one fsync for the whole batch
+        responses.update(manager.export_sandboxes(registered))
+        self.boxes = []
+        return responses
+
+
+class BoxIndex(object):
+    """
+    On-disk sqlite index of the boxes folder, every row keeps the mtime and
+    size of its <box>.json so only files edited since the last call are
+    parsed again.
+    """
+    columns = ['name', '_id', 'mtime', 'size'] + [
+        k for k in Box.attrs if k != 'name'
+    ] + ['data']
+
+    def __init__(self, database, folder):
+        super().__init__()
+        self.folder = folder
+        # shared by the worker threads of bulk commands
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS boxes ({columns}, '
+            'PRIMARY KEY (name))'.format(columns=', '.join(self.columns))
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS boxes_id ON boxes (_id)'
+        )
+        self.connection.commit()
+
+    def filename(self, name):
+        return os.path.join(self.folder, name + '.json')
+
+    def store(self, name, box, stat=None, commit=True):
+        """
+        :param name: name of box
+        :param box: content of <name>.json
+        :param stat: os.stat_result of <name>.json
+        """
+        stat = stat or os.stat(self.filename(name))
+        sandbox = box.get('sandbox', {})
+        values = [name, box.get('_id'), stat.st_mtime_ns, stat.st_size] + [
+            sandbox.get(k) for k in Box.attrs if k != 'name'
+        ] + [json.dumps(box)]
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO boxes VALUES ({0})'.format(
+                    ', '.join('?' * len(values))
+                ), values
+            )
+            if commit:
+                self.connection.commit()
+
+    def discard(self, name):
+        with self.lock:
+            self.connection.execute('DELETE FROM boxes WHERE name = ?', (name,))
+            self.connection.commit()
+
+    def load(self, name):
+        """
+        :param name: name of box
+        :return: content of <name>.json or None, re-read only when its mtime changed
+        """
+        try:
+            stat = os.stat(self.filename(name))
+        except FileNotFoundError:
+            self.discard(name)
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT mtime, size, data FROM boxes WHERE name = ?', (name,)
+            ).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return json.loads(row[2])
+        with open(self.filename(name), 'r') as infile:
+            box = json.load(infile)
+        self.store(name, box, stat)
+        return box
+
+    def get(self, attr, value):
+        """
+        :param attr: name or _id
+        :param value:
+        :return: box or None
+        """
+        if attr == 'name':
+            return self.load(value)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT name FROM boxes WHERE _id = ?', (value,)
+            ).fetchone()
+        box = self.load(row[0]) if row else None
+        if box and box.get('_id') == value:
+            return box
+        return None
+
+    def refresh(self):
+        """
+        Synchronize the index with the boxes folder, parsing only new or
+        modified files and dropping rows of deleted files.
+        """
+        with self.lock:
+            known = dict(
+                (name, (mtime, size)) for name, mtime, size in
+                self.connection.execute('SELECT name, mtime, size FROM boxes')
+            )
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.name.endswith('.json'):
+                        continue
+                    name = entry.name[:-len('.json')]
+                    stat = entry.stat()
+                    if known.pop(name, None) != (stat.st_mtime_ns, stat.st_size):
+                        with open(entry.path, 'r') as infile:
+                            self.store(name, json.load(infile), stat, commit=False)
+            self.connection.executemany(
+                'DELETE FROM boxes WHERE name = ?', [(name,) for name in known]
+            )
+            self.connection.commit()
+
+    def names(self):
+        self.refresh()
+        with self.lock:
+            return [
+                name for name, in
+                self.connection.execute('SELECT name FROM boxes ORDER BY name')
+            ]
+
+    def sandboxes(self):
+        return self.query()
+
+    def query(self, where=(), fields=None, sort='name', limit=None, offset=0):
+        """
+        Filter, sort and page the boxes in sqlite, rows are fetched in
+        batches so the boxes are yielded while the cursor advances.
+        :param where: [(field, '=' or '!=', value)], a value with * ? [ is a glob
+        :param fields: sandbox fields of every row, the whole box when None
+        :param sort: field, -field for descending order
+        :param limit: rows to return, all when None
+        :param offset: rows to skip
+        :return: generator of boxes or of {field: value} when fields is given,
+            ValueError on unknown fields before anything is yielded
+        """
+        known = ['_id'] + Box.attrs
+        for field in [f for f, _, _ in where] + list(fields or []) + [sort.lstrip('-')]:
+            if field not in known:
+                raise ValueError('field {0} is not one of {1}'.format(field, ', '.join(known)))
+        clauses, params = [], []
+        for field, operator, value in where:
+            if field == '_id':
+                clauses.append('_id {0} ?'.format('=' if operator == '=' else '!='))
+                try:
+                    params.append(int(value))
+                except ValueError:
+                    raise ValueError('_id {0} is not an integer'.format(value))
+            elif any(c in value for c in '*?['):
+                clauses.append('{0} {1}GLOB ?'.format(field, '' if operator == '=' else 'NOT '))
+                params.append(value)
+            else:
+                clauses.append('{0} {1} ?'.format(field, '=' if operator == '=' else '!='))
+                params.append(value)
+        sql = 'SELECT {columns} FROM boxes{where} ORDER BY {sort}{order}, name LIMIT ? OFFSET ?'.format(
+            columns=', '.join(fields) if fields else 'data',
+            where=' WHERE ' + ' AND '.join(clauses) if clauses else '',
+            sort=sort.lstrip('-'),
+            order=' DESC' if sort.startswith('-') else ''
+        )
+        params += [-1 if limit is None else limit, offset]
+        return self.rows(sql, params, fields)
+
+    def rows(self, sql, params, fields=None):
+        self.refresh()
+        cursor = self.connection.cursor()
+        with self.lock:
+            cursor.execute(sql, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(fields, row)) if fields else json.loads(row[0])
 
 
 class ManagerContext(object):
@@ -110,90 +564,914 @@ class ManagerContext(object):
     def __init__(self, env):
         super().__init__()
         self.settings = self.get_settings(env)
-        self.boxes = []
+        self.boxes = BoxTable()
+        # first use of the lazy properties from the threads of bulk commands
+        self.lock = threading.RLock()
+        # semaphores by step resource (clone, solve), empty means unlimited
+        self.limits = {}
+        self.index = BoxIndex(
+            os.path.join(
+                self.settings.contexts.location,
+                self.settings.containers.location,
+                self.settings.containers.get('index', 'boxes.db')
+            ),
+            os.path.join(
+                self.settings.contexts.location,
+                self.settings.containers.boxes
+            )
+        )
 
     def registry(self, box):
-        ids = [_b['_id'] for _b in self.boxes if _b]
-        if box['_id'] not in ids:
-            self.boxes.append(box)
-            return {'status': 'successful'}
-        return {'status': 'failed'}
+        response = self.boxes.add(box)
+        if response['status'] != 'successful':
+            # the table may still hold boxes another process removed since
+            for attr, value in (('_id', box['_id']), ('name', box['sandbox']['name'])):
+                held = self.boxes.get(attr, value)
+                stored = held and self.index.get('name', held['sandbox']['name'])
+                if held and (not stored or stored['_id'] != held['_id']):
+                    self.boxes.discard(held['sandbox']['name'])
+            response = self.boxes.add(box)
+        return response
 
     def retrieve_sandboxes(self):
+        self.boxes.load(self.index.sandboxes())
         retrieves = {
-            'containers': []
+            'containers': sorted(self.boxes, key=lambda b: b['sandbox']['name'])
         }
-        loc_boxes = os.path.join(
-            self.settings.contexts.location,
-            self.settings.containers.boxes
-        )
-        boxes = os.listdir(loc_boxes)
-        for box in boxes:
-            name = box.replace('.json', '')
-            sandbox = self.import_sandbox(name)
-            retrieves['containers'].append(sandbox)
         return retrieves
 
     def import_sandbox(self, name):
         try:
-            loc_boxes = os.path.join(
-                self.settings.contexts.location,
-                self.settings.containers.boxes
-            )
-            boxes = os.listdir(loc_boxes)
-            box_name = name + '.json'
-            if box_name in boxes:
-                loc_sandbox = os.path.join(
-                    loc_boxes,
-                    box_name
-                )
-                sandbox = json.load(open(loc_sandbox, 'r'))
+            sandbox = self.index.load(name)
+            if sandbox:
                 return sandbox
             return {'status': 'failed'}
         except Exception as Error:
             raise Error
 
+    def register_sandbox(self, box):
+        """
+        registry and export of one box
+        :return: response of the export, ValueError when the name or the id
+        belongs to another box
+        """
+        response = self.registry(box)
+        if response['status'] == 'successful':
+            response = self.export_sandbox(box)
+        if response['status'] != 'successful':
+            raise ValueError('box {0} was not registered: {1}'.format(
+                box['sandbox']['name'], response.get('error', response['status'])
+            ))
+        return response
+
     def export_sandbox(self, box):
-        try:
-            box = self.get_sandbox('_id', box.get('_id'))
-            loc_file = os.path.join(
+        return self.export_sandboxes([box])[box['sandbox']['name']]
+
+    @traced('registry')
+    def export_sandboxes(self, boxes):
+        """
+        Write <name>.json of every box with write-and-rename while holding the
+        lock of the boxes folder. A batch of several boxes is first written to a
+        journal that is fsynced once, so a crash in the middle is replayed on
+        the next export instead of paying one fsync per box while writing. The
+        box files are fsynced back to back at the end, before the journal that
+        could replay them is removed.
+        :param boxes: registered boxes
+        :return: {name: {'status': ...}}
+        """
+        loc_boxes = os.path.join(
+            self.settings.contexts.location,
+            self.settings.containers.boxes
+        )
+        responses = {}
+        with folder_lock(loc_boxes):
+            self.recover_sandboxes(loc_boxes)
+            accepted = []
+            for box in boxes:
+                name = box['sandbox']['name']
+                owner = self.index.get('_id', box['_id'])
+                existing = self.index.get('name', name)
+                if owner and owner['sandbox']['name'] != name:
+                    responses[name] = {'status': 'failed', 'error': 'id {0} belongs to {1}'.format(
+                        box['_id'], owner['sandbox']['name']
+                    )}
+                elif existing and existing['_id'] != box['_id']:
+                    responses[name] = {'status': 'failed', 'error': 'name {0} belongs to id {1}'.format(
+                        name, existing['_id']
+                    )}
+                else:
+                    accepted.append(box)
+            journal = None
+            if len(accepted) > 1:
+                journal = write_atomic(
+                    os.path.join(loc_boxes, '.journal-{0}.json'.format(tracer.run)),
+                    json.dumps(accepted), fsync=True
+                )
+                fsync_folder(loc_boxes)
+            for box in accepted:
+                name = box['sandbox']['name']
+                write_atomic(
+                    os.path.join(loc_boxes, '{filename}.json'.format(filename=name)),
+                    json.dumps(
+                        box, indent=4, sort_keys=True,
+                        separators=(',', ': '), ensure_ascii=False
+                    ), fsync=journal is None
+                )
+                self.index.store(name, box)
+                responses[name] = {'status': 'successful'}
+            if journal:
+                # only the files of this batch, not every dirty page of the machine
+                for box in accepted:
+                    fsync_file(os.path.join(loc_boxes, '{filename}.json'.format(
+                        filename=box['sandbox']['name']
+                    )))
+            if accepted:
+                fsync_folder(loc_boxes)
+            if journal:
+                os.remove(journal)
+        return responses
+
+    def recover_sandboxes(self, loc_boxes):
+        """
+        Replay the journals of batches interrupted before they finished
+        """
+        import glob
+        for journal in glob.glob(os.path.join(loc_boxes, '.journal-*.json')):
+            with open(journal, 'r') as infile:
+                boxes = json.load(infile)
+            for box in boxes:
+                write_atomic(
+                    os.path.join(loc_boxes, '{filename}.json'.format(
+                        filename=box['sandbox']['name']
+                    )),
+                    json.dumps(
+                        box, indent=4, sort_keys=True,
+                        separators=(',', ': '), ensure_ascii=False
+                    ), fsync=True
+                )
+            os.remove(journal)
+
+    def get_sandbox(self, attr, value):
+        return self.boxes.get(attr, value)
+
+    @property
+    def hosts(self):
+        """
+        [hosts] user@host:port = capacity, or the pipeline alone with [contexts] capacity.
+        Steps like conda_export read the environments from this machine, the
+        context location and [environments] prefix must be shared storage
+        seen at the same path by every host.
+        :return: HostPool
+        """
+        with self.lock:
+            if getattr(self, '_hosts', None) is None:
+                hosts = dict(
+                    (host, int(capacity)) for host, capacity in self.settings.get('hosts', {}).items()
+                )
+                if hosts:
+                    if not self.settings.environments.get('prefix'):
+                        raise ValueError('[hosts] needs [environments] prefix on storage shared by every host')
+                    self._hosts = HostPool(hosts, self.connect_host)
+                else:
+                    contexts = self.settings.contexts
+                    self._hosts = HostPool(
+                        {contexts.get('pipeline') or 'localhost': int(contexts.get('capacity', 4))},
+                        lambda host: connect_executor()
+                    )
+            return self._hosts
+
+    def connect_host(self, host):
+        """
+        :return: executor of a host of [hosts], checked to see the shared
+        context location and environments prefix
+        """
+        executor = connect_executor(host)
+        if getattr(executor, 'remote', False):
+            shared = [self.settings.contexts.location, self.settings.environments.prefix]
+            result = executor.local(
+                'test -d {0} -a -d {1}'.format(*[shlex.quote(s) for s in shared]), warn=True, hide=True
+            )
+            if not result.ok:
+                raise ValueError('host {0} does not see {1}'.format(host, ' and '.join(shared)))
+        return executor
+
+    @property
+    def cache(self):
+        if getattr(self, '_cache', None) is None:
+            cache = self.settings.get('cache', {})
+            self._cache = EnvironmentCache(
                 os.path.join(
                     self.settings.contexts.location,
-                    self.settings.containers.boxes
+                    cache.get('location', 'cache')
                 ),
-                '{filename}.json'.format(
-                    filename=box['sandbox']['name']
-                )
+                parse_size(cache.get('budget', '20G'))
             )
-            with io.open(loc_file, 'w', encoding='utf8') as out:
-                str_ = json.dumps(
-                    box, indent=4, sort_keys=True,
-                    separators=(',', ': '), ensure_ascii=False
-                )
-                out.write(str(str_))
-            return {'status': 'successful'}
-        except Exception as Error:
-            return {'status': Error}
+        return self._cache
 
-    def get_sandbox(self, attr, value):
-        for box in self.boxes:
-            sandbox = box['sandbox']
-            if attr == '_id' and box['_id'] == value:
-                return box
-            elif sandbox[attr] == value:
-                return box
-        return {}
+    def location(self, section):
+        """
+        :param section: contexts, containers, repositories, profiles or environments
+        :return: absolute path of the section location
+        """
+        return os.path.join(
+            self.settings.contexts.location,
+            self.settings[section].location
+        )
 
     def get_settings(self, env):
         try:
             settings = ConfigParser(dict_type=AttrDict)
             settings.read(env)
             if settings._sections:
+                if 'hosts' in settings._sections:
+                    settings._sections['hosts'] = self.get_hosts(env)
                 return settings._sections
             raise TypeError
         except TypeError:
             raise ValueError('settings was not found')
 
+    def get_hosts(self, env):
+        """
+        [hosts] is read on its own, its keys are user@host:port so ':' is
+        not a delimiter there and the host names keep their case
+        :return: {host: capacity}
+        """
+        lines, inside = [], False
+        with open(env, 'r') as infile:
+            for line in infile:
+                if line.startswith('['):
+                    inside = line.strip() == '[hosts]'
+                if inside:
+                    lines.append(line)
+        hosts = ConfigParser(dict_type=AttrDict, delimiters=('=',))
+        hosts.optionxform = str
+        hosts.read_string(''.join(lines))
+        return hosts._sections['hosts']
+
+
+class Lazy(object):
+    """
+    Proxy that builds its instance on the first attribute access, so the
+    commands which never touch it do not pay for it
+    """
+
+    def __init__(self, factory):
+        super().__init__()
+        self.__dict__['_factory'] = factory
+        self.__dict__['_instance'] = None
+
+    def __getattr__(self, attr):
+        if self._instance is None:
+            self.__dict__['_instance'] = self._factory()
+        return getattr(self._instance, attr)
+
+
+class UnexpectedExit(Exception):
+    """
+    Command finished with a non zero exit code
+    """
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+    def __str__(self):
+        stderr = (getattr(self.result, 'stderr', '') or '').strip().splitlines()
+        return 'command {0!r} exited with {1}{2}'.format(
+            getattr(self.result, 'command', None),
+            getattr(self.result, 'exited', None),
+            ': ' + stderr[-1] if stderr else ''
+        )
+
+
+class Result(object):
+    """
+    Outcome of a command, same attributes as the invoke Result used by
+    generate_response
+    """
+
+    def __init__(self, command, exited=0, stdout='', stderr='', size=None, log=None):
+        super().__init__()
+        self.command = command
+        self.exited = exited
+        self.stdout = stdout
+        self.stderr = stderr
+        self.size = size
+        self.log = log
+
+    @property
+    def ok(self):
+        return self.exited == 0
+
+    @property
+    def return_code(self):
+        return self.exited
+
+
+class Executor(object):
+    """
+    Run commands for the steps, backends implement run(argv, cwd) and
+    return a Result
+    """
+
+    def local(self, command, warn=False, hide=None, cwd=None):
+        """
+        :param command: argv list or a command line without shell operators
+        :param warn: return the failed Result instead of raising UnexpectedExit
+        :param hide: do not echo stdout/stderr
+        :param cwd: working directory
+        :return: Result
+        """
+        argv = shlex.split(command) if isinstance(command, str) else list(command)
+        result = self.run(argv, cwd)
+        if not hide:
+            sys.stdout.write(result.stdout)
+            sys.stderr.write(result.stderr)
+        if not result.ok and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def run(self, argv, cwd=None):
+        raise NotImplementedError
+
+
+class SubprocessExecutor(Executor):
+    """
+    Execute the program directly with asyncio.create_subprocess_exec, no shell
+    """
+
+    def run(self, argv, cwd=None):
+        import asyncio
+        return asyncio.run(self.execute(argv, cwd))
+
+    async def execute(self, argv, cwd=None):
+        import asyncio
+        command = shlex.join(argv)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv, cwd=cwd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError as Error:
+            return Result(command, 127, '', str(Error))
+        stdout, stderr = await process.communicate()
+        return Result(
+            command, process.returncode,
+            stdout.decode('utf8', 'replace'), stderr.decode('utf8', 'replace')
+        )
+
+
+class Progress(object):
+    """
+    Renders the output of the running commands, on a terminal a single
+    status line with the last line received, otherwise every line as is
+    """
+
+    def __init__(self, out=None):
+        super().__init__()
+        self._out = out
+        self.lock = threading.Lock()
+
+    @property
+    def out(self):
+        # sys.stderr at the time of writing, the daemon redirects it per command
+        return self._out or sys.stderr
+
+    @property
+    def tty(self):
+        return hasattr(self.out, 'isatty') and self.out.isatty()
+
+    def update(self, name, stream, line):
+        with self.lock:
+            if self.tty:
+                width = shutil.get_terminal_size().columns - 1
+                text = '[{0}] {1}'.format(name, line.strip())
+                self.out.write('\r\x1b[K' + text[:width])
+                self.out.flush()
+            else:
+                target = sys.stdout if stream == 'stdout' else self.out
+                target.write(line + '\n')
+
+    def done(self):
+        if self.tty:
+            with self.lock:
+                self.out.write('\r\x1b[K')
+                self.out.flush()
+
+
+class StreamingExecutor(SubprocessExecutor):
+    """
+    Read the output line by line while the command runs, every line goes
+    to the progress renderer and to <containers>/logs/<run>/, only the
+    last [contexts] buffer lines of each stream are kept for the Result.
+    The logs of hidden commands that succeed are not kept, the reaper
+    deletes the runs older than [contexts] logs days.
+    """
+    chunk = 65536
+
+    def __init__(self, lines=200, logs=None, progress=None):
+        super().__init__()
+        self.lines = lines
+        self.logs = logs
+        self.progress = progress or Progress()
+        self.counter = itertools.count(1)
+
+    def local(self, command, warn=False, hide=None, cwd=None):
+        import asyncio
+        argv = shlex.split(command) if isinstance(command, str) else list(command)
+        result = asyncio.run(self.execute(argv, cwd, None if hide else self.progress))
+        if hide and result.ok and result.log:
+            # probes like git config --get, nothing worth reading later
+            os.remove(result.log)
+            result.log = None
+        if not result.ok and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def logfile(self, argv):
+        """
+        :return: <logs>/<run>/<number>-<box or program>.log
+        """
+        logs = self.logs or os.path.join(manager.location('containers'), 'logs')
+        folder = os.path.join(logs, tracer.run)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+            # first log of the run, old runs are swept at most once a day
+            swept = os.path.join(logs, '.swept')
+            if not os.path.exists(swept) or os.stat(swept).st_mtime < time.time() - 86400:
+                with open(swept, 'a'):
+                    os.utime(swept)
+                spawn_reaper()
+        name = tracer.labels.get().get('box') or os.path.basename(argv[0])
+        return os.path.join(folder, '{0:03d}-{1}.log'.format(next(self.counter), name))
+
+    async def execute(self, argv, cwd=None, progress=None):
+        import asyncio
+        command = shlex.join(argv)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv, cwd=cwd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError as Error:
+            return Result(command, 127, '', str(Error))
+
+        name = tracer.labels.get().get('box') or os.path.basename(argv[0])
+        buffers = {
+            'stdout': collections.deque(maxlen=self.lines),
+            'stderr': collections.deque(maxlen=self.lines)
+        }
+        counts = {'stdout': 0, 'stderr': 0, 'size': 0}
+
+        def emit(stream, line):
+            line = line.decode('utf8', 'replace')
+            counts[stream] += 1
+            buffers[stream].append(line)
+            if progress is not None and line.strip():
+                progress.update(name, stream, line)
+
+        async def pump(stream, reader, log):
+            pending = b''
+            while True:
+                chunk = await reader.read(self.chunk)
+                if not chunk:
+                    break
+                counts['size'] += len(chunk)
+                log.write(chunk)
+                # conda redraws its progress bars with \r
+                *lines, pending = (pending + chunk).replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+                for line in lines:
+                    emit(stream, line)
+                if len(pending) > self.chunk:
+                    emit(stream, pending)
+                    pending = b''
+            if pending:
+                emit(stream, pending)
+
+        logfile = self.logfile(argv)
+        with open(logfile, 'wb') as log:
+            log.write('$ {0}\n'.format(command).encode('utf8'))
+            await asyncio.gather(
+                pump('stdout', process.stdout, log),
+                pump('stderr', process.stderr, log)
+            )
+            await process.wait()
+        if progress is not None:
+            progress.done()
+
+        def joined(stream):
+            lines = list(buffers[stream])
+            dropped = counts[stream] - len(lines)
+            if dropped:
+                lines.insert(0, '... {0} lines in {1}'.format(dropped, logfile))
+            return '\n'.join(lines) + '\n' if lines else ''
+
+        return Result(
+            command, process.returncode, joined('stdout'), joined('stderr'),
+            size=counts['size'], log=logfile
+        )
+
+
+class InProcessExecutor(Executor):
+    """
+    Filesystem commands done by python itself, without spawning a process
+    """
+
+    def run(self, argv, cwd=None):
+        command = shlex.join(argv)
+        operation = getattr(self, 'do_' + argv[0], None) if argv else None
+        if operation is None:
+            raise ValueError('{0} can not run in process'.format(command))
+        paths = [
+            os.path.join(cwd, p) if cwd else p
+            for p in argv[1:] if not p.startswith('-')
+        ]
+        try:
+            operation([p for p in argv[1:] if p.startswith('-')], paths)
+        except OSError as Error:
+            return Result(command, 1, '', '{0}: {1}'.format(argv[0], Error))
+        return Result(command)
+
+    def do_mkdir(self, flags, paths):
+        for path in paths:
+            if '-p' in flags:
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.mkdir(path)
+
+    def do_rm(self, flags, paths):
+        for path in paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path) or not ('-f' in flags or '-rf' in flags):
+                os.remove(path)
+
+    def do_mv(self, flags, paths):
+        os.rename(paths[0], paths[1])
+
+
+class FabricExecutor(Executor):
+    """
+    fabric connection to the pipeline, imported and opened on the first command
+    """
+
+    def __init__(self, host, remote=False):
+        super().__init__()
+        self.host = host
+        # run on the host instead of locally through the connection
+        self.remote = remote
+        self.connection = None
+
+    def local(self, command, warn=False, hide=None, cwd=None):
+        import fabric
+        import invoke
+        if not isinstance(command, str):
+            command = shlex.join(command)
+        if cwd:
+            command = 'cd {0} && {1}'.format(shlex.quote(cwd), command)
+        if self.connection is None:
+            self.connection = fabric.Connection(self.host)
+        try:
+            if self.remote:
+                return self.connection.run(command, warn=warn, hide=hide)
+            return self.connection.local(command, warn=warn, hide=hide)
+        except invoke.UnexpectedExit as Error:
+            raise UnexpectedExit(Error.result)
+
+
+def connect_executor(host=None):
+    """
+    [contexts] executor selects the backend for commands, stream by
+    default and fabric for remote pipelines
+    :param host: host of [hosts], commands run on it, the pipeline when None
+    :return: Executor
+    """
+    contexts = manager.settings.contexts
+    pipeline = host or contexts.get('pipeline', 'localhost')
+    executor = contexts.get('executor') or (
+        'stream' if pipeline in ('', 'local', 'localhost', '127.0.0.1') else 'fabric'
+    )
+    if executor == 'stream':
+        return StreamingExecutor(int(contexts.get('buffer', 200)))
+    if executor == 'subprocess':
+        return SubprocessExecutor()
+    if executor == 'fabric':
+        return FabricExecutor(pipeline, remote=host is not None)
+    raise ValueError('executor {0} is not supported'.format(executor))
+
+
+class Placed(Lazy):
+    """
+    terminal of the host where the current build was placed, the default
+    executor outside of a build
+    """
+    current = contextvars.ContextVar('placed', default=None)
+
+    def __getattr__(self, attr):
+        placed = self.current.get()
+        if placed is not None:
+            return getattr(placed[1], attr)
+        return super().__getattr__(attr)
+
+
+class HostPool(object):
+    """
+    Pipeline hosts with their capacity, a build is placed on the host with
+    the lowest load and runs with one of the executors kept for that host
+    """
+
+    def __init__(self, hosts, factory):
+        """
+        :param hosts: {host: capacity}
+        :param factory: executor of a host
+        """
+        super().__init__()
+        self.hosts = hosts
+        self.factory = factory
+        self.active = dict((host, 0) for host in hosts)
+        self.idle = dict((host, []) for host in hosts)
+        self.condition = threading.Condition()
+
+    def choose(self, preferred=None):
+        free = [h for h in self.hosts if self.active[h] < self.hosts[h]]
+        if preferred in self.hosts:
+            # the environment of the box lives there, wait for a free slot
+            return preferred if preferred in free else None
+        if not free:
+            return None
+        return min(free, key=lambda h: (self.active[h] / float(self.hosts[h]), -self.hosts[h]))
+
+    @contextlib.contextmanager
+    def place(self, preferred=None):
+        """
+        Hold a slot of a host while the build runs, terminal sends the
+        commands of the build to that host
+        :param preferred: host recorded in the box, if it is still a host
+        :return: name of the host
+        """
+        with self.condition:
+            host = self.choose(preferred)
+            while host is None:
+                self.condition.wait()
+                host = self.choose(preferred)
+            self.active[host] += 1
+            executor = self.idle[host].pop() if self.idle[host] else None
+        try:
+            if executor is None:
+                executor = self.factory(host)
+            token = Placed.current.set((host, executor))
+            try:
+                yield host
+            finally:
+                Placed.current.reset(token)
+        finally:
+            with self.condition:
+                self.active[host] -= 1
+                if executor is not None:
+                    self.idle[host].append(executor)
+                self.condition.notify_all()
+
+
+class Step(object):
+    """
+    Node of a build, func receives the results of the steps in requires
+    """
+
+    def __init__(self, name, func, requires=(), resource=None):
+        super().__init__()
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.resource = resource
+
+    def __call__(self, inputs):
+        limit = manager.limits.get(self.resource) if self.resource else None
+        if limit is None:
+            return self.func(inputs)
+        with limit:
+            return self.func(inputs)
+
+
+class Scheduler(object):
+    """
+    Run a DAG of steps, each one starts as soon as all its requires finished,
+    so independent steps (github and conda) run at the same time.
+    """
+
+    def __init__(self, steps):
+        super().__init__()
+        self.steps = steps
+        names = []
+        for step in steps:
+            missing = [r for r in step.requires if r not in names]
+            if missing:
+                raise ValueError('step {0} requires undeclared steps {1}'.format(
+                    step.name, ', '.join(missing)
+                ))
+            names.append(step.name)
+
+    @staticmethod
+    def failed(result):
+        if isinstance(result, dict):
+            return result.get('status') in ('failed', 'skipped')
+        return not result
+
+    def run(self):
+        """
+        :return: {step: response}, failed steps keep the generate_response shape
+        """
+        import asyncio
+        return asyncio.run(self.execute())
+
+    async def execute(self):
+        import asyncio
+        tasks = {}
+
+        async def run_step(step):
+            inputs = {}
+            for name in step.requires:
+                inputs[name] = await tasks[name]
+            failed = [k for k, v in inputs.items() if self.failed(v)]
+            if failed:
+                return {
+                    'status': 'skipped',
+                    'command': None,
+                    'output': {'requires': failed}
+                }
+            try:
+                return await asyncio.to_thread(step, inputs)
+            except Exception as Error:
+                return {
+                    'status': 'failed',
+                    'command': getattr(getattr(Error, 'result', None), 'command', None),
+                    'output': {'error': str(Error)}
+                }
+
+        for step in self.steps:
+            tasks[step.name] = asyncio.ensure_future(run_step(step))
+        await asyncio.gather(*tasks.values())
+        return dict((name, task.result()) for name, task in tasks.items())
+
+    def raise_for_status(self, results):
+        failed = [
+            (k, v) for k, v in results.items()
+            if self.failed(v) and not (isinstance(v, dict) and v['status'] == 'skipped')
+        ]
+        if failed:
+            raise ValueError('steps failed: {0}'.format(', '.join(
+                '{0} ({1})'.format(k, v['output'].get('error') or v['command'])
+                if isinstance(v, dict) else '{0} ({1})'.format(k, v)
+                for k, v in failed
+            )))
+
+
+class EnvironmentCache(object):
+    """
+    Environments already solved, keyed by language, version and package set.
+    Each entry keeps a clone of the environment and its explicit lockfile,
+    the least recently used entries are removed while the cache is over budget.
+    cache.json is read and written under the lock of the cache folder, shared
+    by the threads and the processes building at the same time.
+    """
+
+    def __init__(self, location, budget):
+        super().__init__()
+        self.location = location
+        self.budget = budget
+        os.makedirs(self.location, exist_ok=True)
+
+    @staticmethod
+    def key(language, packages):
+        """
+        :param language: python3.6
+        :param packages: 'ipython pip'
+        :return: hash of the normalized language and sorted package set
+        """
+        import hashlib
+        _lang = get_language(language)
+        spec = json.dumps({
+            'language': '{0}={1}'.format(_lang['name'].lower(), _lang['version']),
+            'packages': sorted(set((packages or '').split()))
+        }, sort_keys=True)
+        return hashlib.sha256(spec.encode('utf8')).hexdigest()[:16]
+
+    def read(self):
+        try:
+            with open(os.path.join(self.location, 'cache.json'), 'r') as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return {}
+
+    def write(self, entries):
+        write_atomic(
+            os.path.join(self.location, 'cache.json'),
+            json.dumps(entries, indent=4, sort_keys=True), fsync=False
+        )
+
+    def get(self, key):
+        """
+        :param key: EnvironmentCache.key
+        :return: entry with the cached environment or lockfile, None on a miss
+        """
+        with folder_lock(self.location):
+            entries = self.read()
+            entry = entries.get(key)
+            if not entry:
+                return None
+            if entry['environment'] and not os.path.isdir(conda_prefix(entry['environment'])):
+                entry['environment'] = None
+            if not entry['environment'] and not os.path.isfile(entry['lockfile']):
+                del entries[key]
+                self.write(entries)
+                return None
+            entry['used'] = time.time()
+            self.write(entries)
+            return entry
+
+    def put(self, key, name):
+        """
+        Keep a clone and the explicit lockfile of the environment name
+        :param key: EnvironmentCache.key
+        :param name: environment just built
+        """
+        environment = '_cache_{0}'.format(key)
+        lockfile = os.path.join(self.location, key + '.txt')
+        terminal.local(
+            '{conda} create -yn {cache} --clone {env} --offline'.format(
+                conda=LOC_CONDA, cache=environment, env=name
+            )
+        )
+        export_environment(
+            environment, os.path.join(self.location, key + '.yml'), lockfile
+        )
+        with folder_lock(self.location):
+            entries = self.read()
+            entries[key] = {
+                'environment': environment,
+                'lockfile': lockfile,
+                'size': folder_size(conda_prefix(environment)),
+                'used': time.time()
+            }
+            self.write(entries)
+        self.evict()
+
+    def evict(self):
+        with folder_lock(self.location):
+            entries = self.read()
+            total = sum(e['size'] for e in entries.values())
+            for key, entry in sorted(entries.items(), key=lambda e: e[1]['used']):
+                if total <= self.budget:
+                    break
+                if entry['environment']:
+                    terminal.local(
+                        '{conda} remove -n {env} --all --yes'.format(
+                            conda=LOC_CONDA, env=entry['environment']
+                        ), warn=True
+                    )
+                for filename in (entry['lockfile'], entry['lockfile'][:-len('.txt')] + '.yml'):
+                    if os.path.isfile(filename):
+                        os.remove(filename)
+                total -= entry['size']
+                del entries[key]
+            self.write(entries)
+
+
+def parse_size(size):
+    """
+    :param size: 512M, 20G or bytes
+    :return: bytes
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def folder_size(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def conda_prefix(name):
+    """
+    :param name: name of environment
+    :return: prefix of the environment, [environments] prefix or <conda>/envs
+    """
+    base = os.path.dirname(os.path.dirname(LOC_CONDA))
+    if name == 'base':
+        return base
+    envs = manager.settings.environments.get('prefix') or os.path.join(base, 'envs')
+    return os.path.join(envs, name)
+
 
 def get_language(lang):
     """
@@ -208,45 +1486,235 @@ def get_language(lang):
     }
 
 
+def spec_keep(name, language, installer):
+    """
+    Conda packages the spec of a box keeps so env update --prune never
+    removes them: the extra packages of its previous spec, or for a box
+    built by create (no spec yet) the packages of its pinned export
+    :param language: name of the language, python
+    :return: [package]
+    """
+    import yaml
+    loc_export = manager.location('environments')
+    spec = os.path.join(loc_export, '{env}.spec.yml'.format(env=name))
+    if os.path.isfile(spec):
+        filename = spec
+    elif os.path.isdir(conda_prefix(name)):
+        filename = os.path.join(loc_export, '{env}.yml'.format(env=name))
+    else:
+        return []
+    try:
+        with open(filename, 'r') as infile:
+            dependencies = (yaml.safe_load(infile) or {}).get('dependencies') or []
+    except FileNotFoundError:
+        return []
+    keep = []
+    for dependency in dependencies:
+        if not isinstance(dependency, str):
+            continue
+        package = dependency if filename == spec else dependency.split('=')[0]
+        if package.split('=')[0] not in (language, installer) and package not in keep:
+            keep.append(package)
+    return keep
+
+
 def generate_yml(name, language, packages=[], install={}):
+    """
+    Spec of the environment in <environments>/<name>.spec.yml, <name>.yml is
+    the pinned export of the environment and is never overwritten here
+    :return: filename of the spec
+    """
     # https://github.com/conda/conda/blob/54e4a91d0da4d659a67e3097040764d3a2f6aa16/tests/conda_env/support/advanced-pip/environment.yml
+    import yaml
     try:
         _lang = get_language(language)
-        language = '{0}={1}'.format(_lang['name'], _lang['version'])
+        language = '{0}={1}'.format(_lang['name'], _lang['version']) if _lang['version'] else _lang['name']
         installer = install.get('installer')
         requirements = os.path.join(
             install.get('dirname'),
             install.get('filename')
         )
-        if os.path.isfile(requirements):
-            file_install = '-r file:{filename}'.format(filename=requirements)
+        lockfile = None
+        if installer == 'pip' and os.path.isfile(requirements):
+            lockfile = pip_lock(name, _lang['version'], requirements)
+        if lockfile:
+            # installed offline from the wheels of the wheelhouse
+            file_install = [
+                '--no-index',
+                '--find-links {wheelhouse}'.format(wheelhouse=wheelhouse_location()),
+                '-r file:{filename}'.format(filename=lockfile)
+            ]
+        elif os.path.isfile(requirements):
+            file_install = ['-r file:{filename}'.format(filename=requirements)]
+        else:
+            file_install = ['ipython']
+        if installer == 'npm':
+            # npm comes with nodejs, node_modules is linked from the store by npm_install
+            dependencies = [language]
         else:
-            file_install = 'ipython'
-        dependencies = [language, installer, {installer: [file_install]}]
-        dependencies.append(packages) if packages else None
+            dependencies = [language, installer, {installer: file_install}]
+        for package in spec_keep(name, _lang['name'], installer) + (packages or '').split():
+            if package not in dependencies:
+                dependencies.append(package)
         filename = os.path.join(
-            LOC_ENVIRONMENTS,
-            '{env}.yml'.format(env=name)
+            manager.location('environments'),
+            '{env}.spec.yml'.format(env=name)
         )
-        if not os.path.isfile(filename):
+        content = yaml.dump({
+            'name': name,
+            'dependencies': dependencies
+        }, default_flow_style=False)
+        # rewritten only when it changes, so its hash tracks the spec
+        if not os.path.isfile(filename) or open(filename, 'r').read() != content:
             with open(filename, 'w') as outfile:
-                yaml.dump({
-                    'name': name,
-                    'dependencies': dependencies
-                }, outfile, default_flow_style=False)
+                outfile.write(content)
         return filename
     except Exception as Error:
         raise Error
 
 
-def conda_sync(repository, args):
+def wheelhouse_location():
+    """
+    :return: [wheelhouse] location, wheels shared by every box
+    """
+    location = os.path.join(
+        manager.settings.contexts.location,
+        manager.settings.get('wheelhouse', {}).get('location', 'wheelhouse')
+    )
+    os.makedirs(location, exist_ok=True)
+    return location
+
+
+def download_wheel(url, sha256, wheelhouse):
+    """
+    Download url into the wheelhouse unless a wheel with the same hash is there
+    :return: filename of the wheel
+    """
+    import hashlib
+    import tempfile
+    import urllib.parse
+    import urllib.request
+    filename = os.path.join(
+        wheelhouse, urllib.parse.unquote(urllib.parse.urlsplit(url).path.split('/')[-1])
+    )
+    if file_hash(filename) == sha256:
+        return filename
+    descriptor, temporary = tempfile.mkstemp(dir=wheelhouse, prefix='.', suffix='.part')
+    try:
+        digest = hashlib.sha256()
+        with io.open(descriptor, 'wb') as outfile, urllib.request.urlopen(url) as response:
+            for chunk in iter(lambda: response.read(1 << 16), b''):
+                digest.update(chunk)
+                outfile.write(chunk)
+        if digest.hexdigest() != sha256:
+            raise ValueError('{0} does not match sha256 {1}'.format(url, sha256))
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return filename
+
+
+def pip_lock(name, version, requirements):
+    """
+    Pin requirements into <environments>/<name>.requirements.lock with the
+    sha256 of every wheel, downloaded with [wheelhouse] workers threads.
+    The lock is solved again only when requirements or the python version
+    change and every wheel is still in the wheelhouse. [wheelhouse] pip is
+    the resolver, by default the pip of the interpreter running manage.py,
+    or of the conda base on a remote host of [hosts].
+    :param name: name of environment
+    :param version: python version of the environment, 3.6
+    :param requirements: requirements.txt of the repository
+    :return: lockfile, None when some requirement has no wheel
+    """
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    wheelhouse = wheelhouse_location()
+    lockfile = os.path.join(
+        manager.location('environments'), '{env}.requirements.lock'.format(env=name)
+    )
+    header = '# requirements {0} python {1}\n'.format(file_hash(requirements), version)
+    if os.path.isfile(lockfile):
+        with open(lockfile, 'r') as infile:
+            lines = infile.readlines()
+        wheels = [l.split('#', 1)[1].strip() for l in lines[1:] if '#' in l]
+        if lines[:1] == [header] and all(os.path.isfile(os.path.join(wheelhouse, w)) for w in wheels):
+            return lockfile
+
+    # 1. resolve for the python of the environment, wheels only, the report
+    # lives in the wheelhouse where a remote host writes it too
+    descriptor, report = tempfile.mkstemp(dir=wheelhouse, prefix='.', suffix='.json')
+    os.close(descriptor)
+    target = tempfile.mkdtemp(dir=wheelhouse, prefix='.')
+    placed = Placed.current.get()
+    if placed is not None and getattr(placed[1], 'remote', False):
+        python = '{0} run -n base python'.format(LOC_CONDA)
+    else:
+        python = sys.executable
+    try:
+        # --python-version needs --target, nothing is written there with --dry-run
+        pip = manager.settings.get('wheelhouse', {}).get('pip') or '{0} -m pip'.format(python)
+        output = terminal.local(
+            '{pip} install --dry-run --quiet --ignore-installed '
+            '--only-binary=:all: --python-version {version} --target {target} '
+            '--report {report} -r {requirements}'.format(
+                pip=pip, version=version, target=target,
+                report=report, requirements=requirements
+            ), warn=True, hide=True
+        )
+        if not output.ok:
+            return None
+        with open(report, 'r') as infile:
+            installs = json.load(infile)['install']
+    finally:
+        os.remove(report)
+        shutil.rmtree(target, ignore_errors=True)
+
+    # 2. download the missing wheels in parallel
+    pins = []
+    for item in installs:
+        sha256 = item['download_info'].get('archive_info', {}).get('hashes', {}).get('sha256')
+        if not sha256:
+            return None
+        pins.append((item['metadata']['name'], item['metadata']['version'], item['download_info']['url'], sha256))
+    workers = int(manager.settings.get('wheelhouse', {}).get('workers', 8))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        filenames = list(pool.map(lambda p: download_wheel(p[2], p[3], wheelhouse), pins))
+
+    # 3. hash-locked requirements, pip checks every wheel against them
+    write_atomic(lockfile, header + ''.join(
+        '{0}=={1} --hash=sha256:{2}  # {3}\n'.format(pin[0], pin[1], pin[3], os.path.basename(filename))
+        for pin, filename in sorted(zip(pins, filenames), key=lambda p: p[0][0].lower())
+    ), fsync=False)
+    return lockfile
+
+
+def file_hash(filename):
+    """
+    :param filename:
+    :return: sha256 of the content or None when it does not exist
+    """
+    import hashlib
+    if not os.path.isfile(filename):
+        return None
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@traced('conda_sync')
+def conda_sync(repository, args, hashes=None):
     """
     :param env:
     :param pyversion:
-    :return: response
+    :param hashes: hashes recorded by the previous sync of the box
+    :return: response, output.changed is False when nothing was done
     """
     try:
-        environment = repository['output']['repository']
+        environment = args.environment
         installer = {
             'dirname': repository['output']['export'],
             'filename': LOC_INSTALLER[args.language]['filename'],
@@ -255,22 +1723,179 @@ def conda_sync(repository, args):
         filename = generate_yml(
             environment, args.language, args.packages, installer
         )
-        output = terminal.local(
-            '{conda} env create -f {environment}'.format(
-                conda=LOC_CONDA,  #  location of context
-                environment=filename
+        current = {
+            'requirements': file_hash(os.path.join(
+                installer['dirname'], installer['filename']
+            )),
+            'environment': file_hash(filename)
+        }
+        exists = os.path.isdir(conda_prefix(environment))
+        if exists and hashes == current:
+            output = {'ok': True, 'command': None}
+        elif exists:
+            # conda solves only the difference with the installed packages
+            output = terminal.local(
+                '{conda} env update -n {env} -f {environment} --prune'.format(
+                    conda=LOC_CONDA, env=environment, environment=filename
+                )
             )
-        )
+        else:
+            output = terminal.local(
+                '{conda} env create -f {environment}'.format(
+                    conda=LOC_CONDA,  #  location of context
+                    environment=filename
+                )
+            )
+        changed = not (exists and hashes == current)
+        if changed:
+            # pinned export of the environment, as create leaves it
+            export_environment(environment, os.path.join(
+                manager.location('environments'), '{env}.yml'.format(env=environment)
+            ))
+        if installer['installer'] == 'npm':
+            modules = npm_install(environment, installer['dirname'])
+            changed = changed or modules['changed']
         response = generate_response(output, {
             'environment': args.environment,
-            'export': LOC_ENVIRONMENTS,
-            'filename': filename
+            'export': manager.location('environments'),
+            'filename': filename,
+            'hashes': current,
+            'changed': changed
         })
         return response
     except UnexpectedExit as Error:
         raise Error
 
 
+def store_location():
+    """
+    :return: [store] location, files of node_modules by sha256
+    """
+    location = os.path.join(
+        manager.settings.contexts.location,
+        manager.settings.get('store', {}).get('location', 'store')
+    )
+    for folder in ('files', 'trees', 'locks'):
+        os.makedirs(os.path.join(location, folder), exist_ok=True)
+    return location
+
+
+def store_ingest(store, modules):
+    """
+    Move every file of modules into <store>/files/<sha256[:2]>/<sha256>, read
+    only so a box can not change the files it shares with the others
+    :param modules: node_modules folder
+    :return: tree [[path, sha256, mode] or [path, None, link target]]
+    """
+    tree = []
+    for root, dirs, files in os.walk(modules):
+        for filename in sorted(files) + sorted(d for d in dirs if os.path.islink(os.path.join(root, d))):
+            source = os.path.join(root, filename)
+            path = os.path.relpath(source, modules)
+            if os.path.islink(source):
+                tree.append([path, None, os.readlink(source)])
+                continue
+            sha256 = file_hash(source)
+            mode = os.stat(source).st_mode & 0o555
+            destiny = os.path.join(store, 'files', sha256[:2], sha256)
+            if not os.path.exists(destiny):
+                os.makedirs(os.path.dirname(destiny), exist_ok=True)
+                os.chmod(source, mode)
+                os.replace(source, destiny)
+            tree.append([path, sha256, mode])
+    return tree
+
+
+def store_link(store, tree, modules):
+    """
+    Build modules from the tree with hardlinks to the store, copies when the
+    store is on another filesystem
+    """
+    import errno
+    for path, sha256, value in tree:
+        destiny = os.path.join(modules, path)
+        os.makedirs(os.path.dirname(destiny), exist_ok=True)
+        if sha256 is None:
+            os.symlink(value, destiny)
+            continue
+        source = os.path.join(store, 'files', sha256[:2], sha256)
+        try:
+            os.link(source, destiny)
+        except OSError as Error:
+            if Error.errno != errno.EXDEV:
+                raise
+            shutil.copy2(source, destiny)
+
+
+@traced('npm_install')
+def npm_install(name, folder):
+    """
+    node_modules of folder from the store. The package-lock.json of the
+    repository, or one resolved once per package.json, keys a cached tree;
+    npm ci runs only for a lockfile never seen before and its files are
+    moved into the store.
+    :param name: environment with nodejs
+    :param folder: repository with package.json
+    :return: {'key', 'changed', 'files'}
+    """
+    import tempfile
+    store = store_location()
+    package = os.path.join(folder, 'package.json')
+    lockfile = os.path.join(folder, 'package-lock.json')
+    if not os.path.isfile(package):
+        return {'key': None, 'changed': False, 'files': 0}
+    if not os.path.isfile(lockfile):
+        # 1. resolved once per package.json, the repository is left untouched
+        lockfile = os.path.join(store, 'locks', file_hash(package) + '.json')
+        if not os.path.isfile(lockfile):
+            work = tempfile.mkdtemp(dir=store)
+            try:
+                shutil.copy2(package, work)
+                terminal.local(
+                    '{conda} run -n {env} npm install --package-lock-only --ignore-scripts --no-audit --no-fund'.format(
+                        conda=LOC_CONDA, env=name
+                    ), cwd=work
+                )
+                os.replace(os.path.join(work, 'package-lock.json'), lockfile)
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+    key = file_hash(lockfile)
+    modules = os.path.join(folder, 'node_modules')
+    marker = os.path.join(modules, '.store-key')
+    if os.path.isfile(marker) and open(marker, 'r').read() == key:
+        return {'key': key, 'changed': False, 'files': None}
+
+    # 2. tree of the lockfile, installed once and moved into the store
+    trees = os.path.join(store, 'trees', key + '.json')
+    with folder_lock(store):
+        if not os.path.isfile(trees):
+            work = tempfile.mkdtemp(dir=store)
+            try:
+                shutil.copy2(package, work)
+                shutil.copy2(lockfile, os.path.join(work, 'package-lock.json'))
+                terminal.local(
+                    '{conda} run -n {env} npm ci --no-audit --no-fund'.format(
+                        conda=LOC_CONDA, env=name
+                    ), cwd=work
+                )
+                tree = store_ingest(store, os.path.join(work, 'node_modules'))
+                write_atomic(trees, json.dumps(tree), fsync=False)
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+    with open(trees, 'r') as infile:
+        tree = json.load(infile)
+
+    # 3. hardlinks into node_modules of the box
+    if os.path.lexists(modules):
+        shutil.rmtree(modules)
+    store_link(store, tree, modules)
+    # a package.json without dependencies links nothing
+    os.makedirs(modules, exist_ok=True)
+    with open(marker, 'w') as outfile:
+        outfile.write(key)
+    return {'key': key, 'changed': True, 'files': len(tree)}
+
+
 def conda_remove(name):
     try:
         output = terminal.local(
@@ -285,59 +1910,434 @@ def conda_remove(name):
         raise Error
 
 
+@traced('conda_build')
 def conda_build(name, language, packages):
     try:
+        key = EnvironmentCache.key(language, packages)
+        cached = manager.cache.get(key)
         language = get_language(language)
-        output = terminal.local(
-            '{conda} create -yn {env} {language}={version} {packages} --no-default-packages'.format(
+        if cached and cached['environment']:
+            # hit, clone the cached environment without solving
+            command = '{conda} create -yn {env} --clone {cache} --offline'.format(
+                conda=LOC_CONDA, env=name, cache=cached['environment']
+            )
+        elif cached:
+            # hit, install the explicit lockfile without solving
+            command = '{conda} create -yn {env} --file {lockfile} --offline'.format(
+                conda=LOC_CONDA, env=name, lockfile=cached['lockfile']
+            )
+        else:
+            command = '{conda} create -yn {env} {language}={version} {packages} --no-default-packages'.format(
                 conda=LOC_CONDA,  #  location of context
                 env=name,  # name of environment
                 language=language['name'],  #  name of language
                 version=language['version'],  # version of language
-                packages=packages  # packages to install by default
+                packages=packages or ''  # packages to install by default
             )
-        )
+        output = terminal.local(command)
+        if not cached:
+            try:
+                manager.cache.put(key, name)
+            except Exception as Error:
+                # the environment is built, a cache that cannot keep it
+                # (clone or export failed, disk full) must not fail the box
+                sys.stderr.write('cache: {0} not kept, {1}\n'.format(name, Error))
         response = generate_response(output, {
             'environment': name,
             'language': language,
-            'packages': packages
+            'packages': packages,
+            'cache': 'hit' if cached else 'miss'
         })
         return response
     except UnexpectedExit as Error:
         raise Error
 
 
+def pool_location():
+    location = os.path.join(manager.location('containers'), 'pool')
+    os.makedirs(location, exist_ok=True)
+    return location
+
+
+def pool_entries(language=None):
+    """
+    Idle environments ready to be claimed, <pool>/<env>.json is written
+    once the environment is built and removed by the claim
+    :param language: python3.6, nodejs or every language
+    :return: [{'environment', 'language', 'packages', 'built'}] oldest first
+    """
+    entries = []
+    for filename in os.listdir(pool_location()):
+        if not filename.startswith('_pool_') or not filename.endswith('.json'):
+            continue
+        with open(os.path.join(pool_location(), filename), 'r') as infile:
+            entry = json.load(infile)
+        if language is None or entry['language'] == language:
+            entries.append(entry)
+    return sorted(entries, key=lambda e: e['built'])
+
+
+def claim_pool(name, language, packages):
+    """
+    Take an idle environment of the language, rename it to name and install
+    the packages which are not part of the pool on top
+    :return: response of conda_build or None when the pool is empty
+    """
+    if language not in LOC_INSTALLER:
+        return None
+    with folder_lock(pool_location()):
+        entries = pool_entries(language)
+        if not entries:
+            return None
+        entry = entries[0]
+        os.remove(os.path.join(pool_location(), entry['environment'] + '.json'))
+    try:
+        output = terminal.local('{conda} rename -n {pool} {env}'.format(
+            conda=LOC_CONDA, pool=entry['environment'], env=name
+        ))
+    except UnexpectedExit:
+        # keep the environment in the pool and build from scratch
+        write_atomic(
+            os.path.join(pool_location(), entry['environment'] + '.json'),
+            json.dumps(entry)
+        )
+        return None
+    extra = [p for p in (packages or '').split() if p not in entry['packages'].split()]
+    if extra:
+        output = terminal.local('{conda} install -yn {env} {packages}'.format(
+            conda=LOC_CONDA, env=name, packages=' '.join(extra)
+        ))
+    spawn_refill()
+    return generate_response(output, {
+        'environment': name,
+        'language': get_language(language),
+        'packages': packages,
+        'cache': 'pool'
+    })
+
+
+def spawn_refill():
+    """
+    Start manage.py pool --wait detached from the terminal
+    """
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'pool', '--wait'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True,
+        env=dict(os.environ, LOC_SETTINGS=LOC_SETTINGS, LOC_CONDA=LOC_CONDA, LOC_DAEMON='0')
+    )
+
+
+def refill_pool(args=None, session=None):
+    """
+    Build idle environments until every language of LOC_INSTALLER has
+    [pool] size of them, [pool] concurrency builds at a time. A single
+    refill runs at a time.
+    """
+    import fcntl
+    from concurrent.futures import ThreadPoolExecutor
+    pool = manager.settings.get('pool', {})
+    size = int(pool.get('size', 2))
+    concurrency = int(pool.get('concurrency', 1))
+
+    def build(language, environment):
+        packages = LOC_INSTALLER[language]['packages']
+        try:
+            conda_build(environment, language, packages)
+        except UnexpectedExit:
+            terminal.local('{conda} remove -n {env} --all --yes'.format(
+                conda=LOC_CONDA, env=environment
+            ), warn=True)
+            raise
+        write_atomic(os.path.join(pool_location(), environment + '.json'), json.dumps({
+            'environment': environment,
+            'language': language,
+            'packages': packages,
+            'built': time.time()
+        }))
+        return environment
+
+    with open(os.path.join(pool_location(), '.refill.lock'), 'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # another refill is already building the pool
+            return []
+        builds = []
+        for language in LOC_INSTALLER:
+            ready = len(pool_entries(language))
+            prefix = '_pool_{0}_'.format(language.replace('.', ''))
+            numbers = itertools.count(1)
+            for _ in range(size - ready):
+                environment = next(
+                    prefix + str(n) for n in numbers
+                    if not os.path.exists(conda_prefix(prefix + str(n)))
+                )
+                builds.append((language, environment))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda b: build(*b), builds))
+
+
+def pool_box(args, session=None):
+    """
+    Show the idle environments by language and refill the pool, in the
+    background unless --wait, --drain removes the idle environments
+    """
+    try:
+        if args.drain:
+            with folder_lock(pool_location()):
+                entries = pool_entries()
+                for entry in entries:
+                    os.remove(os.path.join(pool_location(), entry['environment'] + '.json'))
+            for entry in entries:
+                terminal.local('{conda} remove -n {env} --all --yes'.format(
+                    conda=LOC_CONDA, env=entry['environment']
+                ), warn=True)
+                print('{0}: removed'.format(entry['environment']))
+            return
+        size = int(manager.settings.get('pool', {}).get('size', 2))
+        for language in LOC_INSTALLER:
+            print('{0}: {1}/{2} idle'.format(language, len(pool_entries(language)), size))
+        if args.wait:
+            for environment in refill_pool(args):
+                print('{0}: built'.format(environment))
+        else:
+            spawn_refill()
+    except Exception as Error:
+        raise Error
+
+
+def conda_meta(name):
+    """
+    :param name: name of environment
+    :return: [record] from <prefix>/conda-meta/*.json sorted by name
+    """
+    import glob
+    records = []
+    for filename in glob.glob(os.path.join(conda_prefix(name), 'conda-meta', '*.json')):
+        with open(filename, 'r') as infile:
+            records.append(json.load(infile))
+    if not records:
+        raise ValueError('environment {0} was not found'.format(name))
+    return sorted(records, key=lambda r: r['name'])
+
+
+def conda_channel(record):
+    """
+    :param record: conda-meta record
+    :return: channel name as conda env export writes it
+    """
+    channel = record.get('channel', '') or ''
+    if channel.endswith('/' + record.get('subdir', '')) or channel.endswith('/noarch'):
+        channel = channel.rsplit('/', 1)[0]
+    if channel.startswith('https://repo.anaconda.com/pkgs/') or channel in ('pkgs/main', 'defaults'):
+        return 'defaults'
+    if channel.startswith('https://conda.anaconda.org/'):
+        return channel.replace('https://conda.anaconda.org/', '')
+    return channel
+
+
+def pip_packages(name, records):
+    """
+    :param name: name of environment
+    :param records: conda-meta records, their packages are not reported
+    :return: [name==version] installed by pip in the environment
+    """
+    import glob
+    installed = set(r['name'].lower().replace('_', '-') for r in records)
+    prefix = conda_prefix(name)
+    packages = []
+    folders = glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages', '*.dist-info')) + \
+        glob.glob(os.path.join(prefix, 'Lib', 'site-packages', '*.dist-info'))
+    for folder in folders:
+        try:
+            with open(os.path.join(folder, 'INSTALLER'), 'r') as infile:
+                if infile.read().strip() != 'pip':
+                    continue
+        except FileNotFoundError:
+            continue
+        package, version = os.path.basename(folder)[:-len('.dist-info')].rsplit('-', 1)
+        if package.lower().replace('_', '-') not in installed:
+            packages.append('{0}=={1}'.format(package, version))
+    return sorted(packages, key=str.lower)
+
+
+def export_environment(name, filename, lockfile=None):
+    """
+    Write the environment.yml of conda env export (without prefix) and
+    optionally the explicit lockfile of conda list --explicit --md5, from
+    the conda-meta records instead of running conda
+    :param name: name of environment
+    :param filename: environment.yml
+    :param lockfile: explicit lockfile
+    """
+    import yaml
+    records = conda_meta(name)
+    channels = []
+    for record in records:
+        channel = conda_channel(record)
+        if channel and channel not in channels:
+            channels.append(channel)
+    if 'defaults' in channels:
+        channels.insert(0, channels.pop(channels.index('defaults')))
+    # then the channels configured in .condarc, as conda env export does
+    for condarc in (
+        os.path.join(os.path.dirname(os.path.dirname(LOC_CONDA)), '.condarc'),
+        os.path.expanduser('~/.condarc')
+    ):
+        if os.path.isfile(condarc):
+            with open(condarc, 'r') as infile:
+                config = yaml.safe_load(infile) or {}
+            for channel in config.get('channels', []) or []:
+                if channel not in channels:
+                    channels.append(channel)
+    dependencies = [
+        '{name}={version}={build}'.format(**record) for record in records
+    ]
+    pip = pip_packages(name, records)
+    if pip:
+        dependencies.append({'pip': pip})
+    class Dumper(yaml.SafeDumper):
+        # indent lists under their key like conda env export does
+        def increase_indent(self, flow=False, indentless=False):
+            return super().increase_indent(flow, False)
+
+    with open(filename, 'w') as outfile:
+        yaml.dump({
+            'name': name,
+            'channels': channels,
+            'dependencies': dependencies
+        }, outfile, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+    if lockfile:
+        platform = [r['subdir'] for r in records if r.get('subdir', 'noarch') != 'noarch']
+        with open(lockfile, 'w') as outfile:
+            outfile.write('# This file may be used to create an environment using:\n')
+            outfile.write('# $ conda create --name <env> --file <this file>\n')
+            outfile.write('# platform: {0}\n'.format(platform[0] if platform else 'noarch'))
+            outfile.write('@EXPLICIT\n')
+            for record in records:
+                outfile.write('{0}#{1}\n'.format(record['url'], record['md5']))
+    return filename
+
+
+@traced('conda_export')
 def conda_export(name):
     """
     :param envname:
     :return: response
     """
     try:
-        loc_export = os.path.join(
-            manager.settings.contexts.location,
-            LOC_ENVIRONMENTS
-        )
+        loc_export = manager.location('environments')
         filename = '{loc}/{env}.yml'.format(
             env=name,  # name of environment
             loc=loc_export  # destiny for export the environment.yml
         )
-        output = terminal.local(
-            '{conda} env export -n {env} | grep -v "^prefix: " > {filename}'.format(
-                conda=LOC_CONDA,  # path absolute the conda
-                env=name,
-                filename=filename  # export filename
-            )
-        )
-        response = generate_response(output, {
+        lockfile = None
+        if str2bool(manager.settings.environments.get('lockfile', 'no')):
+            lockfile = '{loc}/{env}.txt'.format(env=name, loc=loc_export)
+        export_environment(name, filename, lockfile)
+        response = generate_response({'ok': True, 'command': None}, {
             'environment': name,
             'export': loc_export,
-            'filename': filename
+            'filename': filename,
+            'lockfile': lockfile
         })
         return response
-    except UnexpectedExit as Error:
+    except Exception as Error:
         raise Error
 
 
+def ipython_version(name):
+    """
+    :param name: name of environment
+    :return: version of ipython installed in the environment or None
+    """
+    import glob
+    try:
+        records = conda_meta(name)
+    except ValueError:
+        return None
+    for record in records:
+        if record['name'] == 'ipython':
+            return record['version']
+    for folder in glob.glob(os.path.join(
+        conda_prefix(name), 'lib', 'python*', 'site-packages', '[Ii][Pp]ython-*.dist-info'
+    )):
+        return os.path.basename(folder)[:-len('.dist-info')].split('-')[1]
+    return None
+
+
+def profile_template(name, version):
+    """
+    Default profile generated once per ipython major version by
+    ipython profile create, kept in <profiles>/.templates/ipython<major>
+    :param name: environment with ipython installed, used to build a missing template
+    :param version: version of ipython
+    :return: location of the template
+    """
+    import tempfile
+    templates = os.path.join(manager.location('profiles'), '.templates')
+    template = os.path.join(templates, 'ipython{0}'.format(version.split('.')[0]))
+    if os.path.isdir(template):
+        return template
+    os.makedirs(templates, exist_ok=True)
+    folder = tempfile.mkdtemp(dir=templates)
+    try:
+        terminal.local(
+            '{conda} run -n {env} ipython profile create template --ipython-dir {export}'.format(
+                conda=LOC_CONDA, env=name, export=folder
+            )
+        )
+        try:
+            os.rename(os.path.join(folder, 'profile_template'), template)
+        except OSError:
+            # built at the same time by another box
+            if not os.path.isdir(template):
+                raise
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return template
+
+
+def render_profile(template, target, values, link=False):
+    """
+    Copy the template into target keeping the modes of every folder and file,
+    files with {{key}} placeholders are rendered with values, the rest are
+    copied or hardlinked. Existing files are kept, like ipython profile create.
+    Config files (.py and .json) are always copied, editing the config of
+    one profile must not edit the template and every other profile.
+    :param template: location of the template
+    :param target: location of the profile
+    :param values: {key: value}
+    :param link: hardlink the files without placeholders
+    """
+    for root, dirs, files in os.walk(template):
+        folder = os.path.join(target, os.path.relpath(root, template))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+            os.chmod(folder, os.stat(root).st_mode & 0o7777)
+        for filename in files:
+            source = os.path.join(root, filename)
+            destiny = os.path.join(folder, filename)
+            if os.path.lexists(destiny):
+                continue
+            with open(source, 'rb') as infile:
+                content = infile.read()
+            if b'{{' in content:
+                for key, value in values.items():
+                    content = content.replace(
+                        '{{{{{0}}}}}'.format(key).encode('utf8'), str(value).encode('utf8')
+                    )
+                with open(destiny, 'wb') as outfile:
+                    outfile.write(content)
+                shutil.copymode(source, destiny)
+            elif link and not filename.endswith(('.py', '.json')):
+                os.link(source, destiny)
+            else:
+                shutil.copy2(source, destiny)
+
+
+@traced('profile_build')
 def profile_build(name):
     """
     :param envname:
@@ -349,14 +2349,26 @@ def profile_build(name):
             manager.settings.profiles.location
         )
         iprofile = '[{name}]'.format(name=name)
-        output = terminal.local(
-            '{conda} run -n {env} ipython profile create {profile} --ipython-dir {export}'.format(
-                conda=LOC_CONDA,  # path absolute the conda
-                env=name,  # name of environment
-                profile=iprofile,  # name of profile
-                export=loc_export  # location for save profile
+        version = ipython_version(name)
+        if not version:
+            output = terminal.local(
+                '{conda} run -n {env} ipython profile create {profile} --ipython-dir {export}'.format(
+                    conda=LOC_CONDA,  # path absolute the conda
+                    env=name,  # name of environment
+                    profile=iprofile,  # name of profile
+                    export=loc_export  # location for save profile
+                )
             )
-        )
+        else:
+            template = profile_template(name, version)
+            target = os.path.join(loc_export, 'profile_{0}'.format(iprofile))
+            render_profile(template, target, {
+                'name': name,
+                'profile': iprofile,
+                'environment': name,
+                'ipython_dir': loc_export
+            }, link=str2bool(manager.settings.profiles.get('hardlink', 'no')))
+            output = Result('render {0} {1}'.format(template, target))
         response = generate_response(output, {
             'env': name,
             'profile': iprofile,
@@ -393,7 +2405,7 @@ def start_repository(folder, start_git):
         )
         mkdir_resp = mkdir_folder(loc_folder)
         if start_git:
-            output = terminal.local('cd {folder} && git init'.format(
+            output = terminal.local('git init {folder}'.format(
                 folder=loc_folder
             ))
         else:
@@ -407,44 +2419,317 @@ def start_repository(folder, start_git):
         raise Error
 
 
+class GithubError(Exception):
+    """
+    GitHub API answered with an error status
+    """
+
+    def __init__(self, status, message, path=None):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+        self.path = path
+
+    def __str__(self):
+        return 'github {0} {1}: {2}'.format(self.path, self.status, self.message)
+
+
+class GithubClient(object):
+    """
+    Client of the GitHub REST API shared by the boxes of a command. Every
+    thread keeps one keep-alive connection, GET answers are cached with their
+    ETag in <containers>/github.json and revalidated with If-None-Match (a
+    304 does not count against the rate limit), requests wait for the reset
+    when X-RateLimit-Remaining runs out and writes are spaced by
+    [repositories] interval seconds as GitHub asks for bulk creation.
+    """
+
+    def __init__(self, token, api='https://api.github.com', cache=None, interval=1.0, attempts=3):
+        super().__init__()
+        import hashlib
+        from urllib.parse import urlsplit
+        url = urlsplit(api)
+        self.scheme, self.netloc, self.path = url.scheme, url.netloc, url.path.rstrip('/')
+        self.token = token
+        # a cached answer only belongs to the token that requested it
+        self.key = hashlib.sha1((token or '').encode('utf8')).hexdigest()[:8]
+        self.cache = cache
+        self.interval = interval
+        self.attempts = attempts
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes = threading.Lock()
+        self.written = 0.0
+        self.remaining = None
+        self.reset = 0.0
+        self._etags = None
+
+    @property
+    def etags(self):
+        if self._etags is None:
+            try:
+                with open(self.cache, 'r') as infile:
+                    self._etags = json.load(infile)
+            except (TypeError, OSError, ValueError):
+                self._etags = {}
+        return self._etags
+
+    def save(self):
+        if self.cache:
+            with self.lock:
+                content = json.dumps(self.etags)
+            os.makedirs(os.path.dirname(self.cache), exist_ok=True)
+            write_atomic(self.cache, content, fsync=False)
+
+    def connection(self):
+        import http.client
+        if getattr(self.local, 'connection', None) is None:
+            factory = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            self.local.connection = factory(self.netloc, timeout=30)
+            self.local.used = False
+        return self.local.connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self.local.connection = None
+
+    def wait(self, write):
+        """
+        Sleep until the rate limit resets when it ran out, and keep writes at
+        least interval seconds apart
+        """
+        with self.lock:
+            delay = self.reset - time.time() if self.remaining == 0 else 0
+        if delay > 0:
+            time.sleep(delay + 1)
+        if write and self.interval:
+            with self.writes:
+                delay = self.written + self.interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.written = time.monotonic()
+
+    def send(self, method, path, payload, headers):
+        """
+        :return: http.client.HTTPResponse and its body, a connection closed
+        by the server while idle is opened again once
+        """
+        import http.client
+        while True:
+            connection = self.connection()
+            reused = self.local.used
+            try:
+                connection.request(method, self.path + path, payload, headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if reused:
+                    continue
+                raise
+            self.local.used = True
+            if response.will_close:
+                self.close()
+            return response, content
+
+    def request(self, method, path, body=None):
+        """
+        :param method: GET, POST, PATCH or DELETE
+        :param path: /user, /repos/<owner>/<name>...
+        :param body: json of the request
+        :return: json of the answer
+        """
+        headers = {
+            'Accept': 'application/vnd.github+json',
+            'User-Agent': 'containers'
+        }
+        if self.token:
+            headers['Authorization'] = 'token {0}'.format(self.token)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf8')
+            headers['Content-Type'] = 'application/json'
+        key = '{0} {1}'.format(self.key, path)
+        cached = self.etags.get(key) if method == 'GET' else None
+        if cached:
+            headers['If-None-Match'] = cached['etag']
+        for attempt in range(self.attempts):
+            self.wait(method != 'GET')
+            response, content = self.send(method, path, payload, headers)
+            with self.lock:
+                if response.getheader('X-RateLimit-Remaining') is not None:
+                    self.remaining = int(response.getheader('X-RateLimit-Remaining'))
+                    self.reset = float(response.getheader('X-RateLimit-Reset') or 0)
+            if response.status in (403, 429) and attempt + 1 < self.attempts and (
+                response.getheader('Retry-After') or self.remaining == 0
+            ):
+                # secondary limits answer Retry-After, primary ones the reset
+                time.sleep(float(response.getheader('Retry-After') or 0))
+                continue
+            break
+        if response.status == 304 and cached:
+            return cached['data']
+        data = json.loads(content) if content else None
+        if response.status >= 400:
+            raise GithubError(response.status, (data or {}).get('message', response.reason), path)
+        if method == 'GET' and response.getheader('ETag'):
+            with self.lock:
+                self.etags[key] = {'etag': response.getheader('ETag'), 'data': data}
+            self.save()
+        return data
+
+    def user(self):
+        return self.request('GET', '/user')
+
+    def repository(self, owner, name):
+        return self.request('GET', '/repos/{0}/{1}'.format(owner, name))
+
+    def create_repo(self, name, **kwargs):
+        """
+        :param name: repository of the authenticated user
+        :param kwargs: private, description... of POST /user/repos
+        :return: json of the repository
+        """
+        return self.request('POST', '/user/repos', dict(kwargs, name=name))
+
+    def create_repos(self, names, workers=4, **kwargs):
+        """
+        Create several repositories sharing the connections, the writes are
+        still spaced by interval so the batch throttles itself
+        :return: {name: json of the repository or GithubError}
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def create(name):
+            try:
+                return self.create_repo(name, **kwargs)
+            except GithubError as Error:
+                return Error
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(names, pool.map(create, names)))
+
+
+def connect_github():
+    repositories = manager.settings.repositories
+    return GithubClient(
+        repositories.get('token'),
+        repositories.get('api', 'https://api.github.com'),
+        cache=os.path.join(manager.location('containers'), 'github.json'),
+        interval=float(repositories.get('interval', 1.0))
+    )
+
+
+@traced('git_create')
 def git_create(name):
     try:
-        git = Github(manager.settings.repositories.token)
-        user = git.get_user()
-        repo = user.create_repo(name)
-        response = git_clone(repo.clone_url)
-        response['output']['url'] = repo.clone_url
+        repo = github.create_repo(name)
+        response = git_clone(repo['clone_url'])
+        response['output']['url'] = repo['clone_url']
         return response
     except Exception as Error:
-        return False
+        raise Error
 
 
-def git_clone(repository):
+def git_mirror(url):
     """
-    :param repository:
+    Bare repository in [repositories] mirrors shared by a repository and its
+    forks, each url is fetched as its own remote with its branches and tags
+    under refs/remotes/<remote>/. Clones borrow its objects through
+    alternates, so nothing is pruned and gc never expires loose objects.
+    :param url:
+    :return: location of the mirror
+    """
+    import hashlib
+    try:
+        name = url.rstrip('/').split('/')[-1].replace('.git', '')
+        mirror = os.path.join(
+            manager.settings.contexts.location,
+            manager.settings.repositories.mirrors,
+            name + '.git'
+        )
+        remote = hashlib.sha1(url.encode('utf8')).hexdigest()[:12]
+        if not os.path.isdir(mirror):
+            terminal.local('git init --bare --quiet {mirror}'.format(mirror=mirror))
+        configured = terminal.local(
+            'git -C {mirror} config --get remote.{remote}.url'.format(
+                mirror=mirror, remote=remote
+            ), warn=True, hide=True
+        )
+        if not configured.ok:
+            terminal.local('git -C {mirror} remote add {remote} {url}'.format(
+                mirror=mirror, remote=remote, url=url
+            ))
+            for key, value in (('gc.auto', '0'), ('gc.pruneExpire', 'never')):
+                terminal.local('git -C {mirror} config {key} {value}'.format(
+                    mirror=mirror, key=key, value=value
+                ))
+        terminal.local(
+            'git -C {mirror} fetch --quiet --no-tags {remote} '
+            '+refs/heads/*:refs/remotes/{remote}/heads/* '
+            '+refs/tags/*:refs/remotes/{remote}/tags/*'.format(
+                mirror=mirror, remote=remote
+            )
+        )
+        return mirror
+    except UnexpectedExit as Error:
+        raise Error
+
+
+@traced('git_clone')
+def git_clone(repository, mode=None):
+    """
+    :param repository: url of repository
+    :param mode: full, shallow (--depth) or partial (--filter=blob:none),
+        [repositories] clone by default
     :return: response
     """
     try:
+        settings = manager.settings.repositories
+        mode = mode or settings.get('clone', 'full')
         location = repository
-        repository = repository.split('/')[-1].replace('.git', '')
+        repository = repository.rstrip('/').split('/')[-1].replace('.git', '')
         folder_path = os.path.join(
-            LOC_REPOSITORIES,
+            manager.location('repositories'),
             repository
         )
-        if not os.path.isdir(folder_path):
-            output = terminal.local(
-                'git clone {url} {location}'.format(
-                    url=location,
-                    location=folder_path
-                )
-            )
-            response = generate_response(output, {
-                'url': repository,
+        if os.path.isdir(folder_path):
+            # existing repository, fetch and fast-forward the current branch
+            terminal.local('git -C {folder} fetch --quiet --prune'.format(
+                folder=folder_path
+            ))
+            output = terminal.local('git -C {folder} merge --quiet --ff-only @{{u}}'.format(
+                folder=folder_path
+            ))
+            return generate_response(output, {
+                'url': location,
                 'repository': repository,
-                'export': folder_path
+                'export': folder_path,
+                'mode': 'fast-forward'
             })
-            return response
-        return 'Existing repository'
+        options = []
+        url = location
+        if mode in ('shallow', 'partial') and os.path.isdir(url):
+            # local paths ignore --depth and --filter unless cloned through file://
+            url = 'file://' + os.path.abspath(url)
+        if mode == 'shallow':
+            options.append('--depth {0}'.format(settings.get('depth', '1')))
+        elif mode == 'partial':
+            options.append('--filter=blob:none')
+        elif mode != 'full':
+            raise ValueError('clone mode {0} is not supported'.format(mode))
+        if settings.get('mirrors'):
+            options.append('--reference-if-able {0}'.format(git_mirror(location)))
+        output = terminal.local(' '.join(['git clone'] + options + [url, folder_path]))
+        response = generate_response(output, {
+            'url': location,
+            'repository': repository,
+            'export': folder_path,
+            'mode': mode
+        })
+        return response
     except UnexpectedExit as Error:
         raise Error
 
@@ -456,7 +2741,7 @@ def mkdir_folder(name):
     """
     try:
         if not os.path.isdir(name):
-            output = terminal.local('mkdir {folder}'.format(folder=name))
+            output = filesystem.local(['mkdir', name])
             response = generate_response(output, {
                 'export': name
             })
@@ -471,18 +2756,28 @@ def generate_response(response, output):
     :param response:
     :return dictionary
     """
-    status, command = None, None
+    status, command, exited, size, log = None, None, None, None, None
 
     if isinstance(response, dict):
-        status = response.get('ok', None) 
-        response.get('command', None)
+        status = response.get('ok', None)
+        command = response.get('command', None)
     elif isinstance(response, object):
         status = getattr(response, 'ok', None)
         command = getattr(response, 'command', None)
-    
+        exited = getattr(response, 'exited', None)
+        size = getattr(response, 'size', None)
+        log = getattr(response, 'log', None)
+        if size is None:
+            size = sum(
+                len(getattr(response, k, None) or '') for k in ('stdout', 'stderr')
+            )
+
     return {
         'status': 'successful' if status else 'failed',
         'command': command,
+        'exited': exited,
+        'size': size,
+        'log': log,
         'output': output
     }
 
@@ -533,60 +2828,486 @@ def create_box(args, session=None):
         sandbox = Box()
         sandbox.name = args.name
         sandbox.language = args.language
-        # 1. crear carpeta y repositorio inicial (git init <nombre repositorio>)
-        starter = git_create(sandbox.name)
-        # 2. crear environment con conda y exporta yml environments/conda (OK)
-        build_env = conda_build(sandbox.name, sandbox.language, args.packages)
-        export_env = conda_export(sandbox.name)
-        # 3. crear profile en ipython en carpeta correspondiente (OK)
-        build_profile = profile_build(sandbox.name)
-        # 4. crear archivo <box>.json y guardarlo en carpeta containers/boxes (OK)
-        response = clean_response({
-            'repository': starter, 'environment': export_env, 'profile': build_profile
-        })
-        sandbox.update(response)
+        tracer.label(box=sandbox.name, language=sandbox.language)
+        scheduler = Scheduler([
+            # 1. crear carpeta y repositorio inicial (git init <nombre repositorio>)
+            Step('repository', lambda r: git_create(sandbox.name), resource='clone'),
+            # 2. crear environment con conda y exporta yml environments/conda (OK)
+            #    claimed from the pool of idle environments when there is one
+            Step('build', lambda r: claim_pool(
+                sandbox.name, sandbox.language, args.packages
+            ) or conda_build(
+                sandbox.name, sandbox.language, args.packages
+            ), resource='solve'),
+            Step('environment', lambda r: conda_export(sandbox.name), requires=['build']),
+            # 3. crear profile en ipython en carpeta correspondiente (OK)
+            Step('profile', lambda r: profile_build(sandbox.name), requires=['build']),
+            # 4. crear archivo <box>.json y guardarlo en carpeta containers/boxes (OK)
+            Step('response', clean_response, requires=['repository', 'environment', 'profile'])
+        ])
+        with manager.hosts.place() as host:
+            sandbox.host = host
+            tracer.label(host=host)
+            results = scheduler.run()
+        scheduler.raise_for_status(results)
+        sandbox.update(results['response'])
         # 5. Export metadata to json file in boxes folder
         box = sandbox.retrieve()
-        response = manager.registry(box)
-        manager.export_sandbox(box)
+        manager.register_sandbox(box)
     except Exception as Error:
         raise (Error)
 
 
+def trash_roots():
+    """
+    :return: <containers>/trash and the .trash folders of other filesystems
+    recorded in <containers>/trash/.roots
+    """
+    loc_trash = os.path.join(manager.location('containers'), 'trash')
+    roots = [loc_trash]
+    try:
+        with open(os.path.join(loc_trash, '.roots'), 'r') as infile:
+            roots.extend(r for r in infile.read().splitlines() if r and r not in roots)
+    except FileNotFoundError:
+        pass
+    return roots
+
+
+def trash_location(source, trash):
+    """
+    A rename cannot cross filesystems, sources living on another one than
+    the containers (the conda envs usually) go to a .trash folder next to them
+    :param source: file or folder of a box
+    :param trash: <containers>/trash/<box>-<run>
+    :return: trash folder of source
+    """
+    parent = os.path.dirname(os.path.abspath(source))
+    if os.stat(parent).st_dev == os.stat(os.path.dirname(trash)).st_dev:
+        return trash
+    root = os.path.join(parent, '.trash')
+    if root not in trash_roots():
+        with open(os.path.join(os.path.dirname(trash), '.roots'), 'a') as outfile:
+            outfile.write(root + '\n')
+    return os.path.join(root, os.path.basename(trash))
+
+
+def trash_box(name):
+    """
+    Rename every file and folder of the box into <containers>/trash in one
+    quick pass, or into the .trash folder of its own filesystem, the data is
+    deleted later by the reaper. When a rename fails the ones already done
+    are rolled back and the box is kept.
+    :param name: name of box
+    :return: location of the box in the trash
+    """
+    box = manager.import_sandbox(name)
+    # build a box
+    sandbox = Box()
+    # assigned attributes from sandbox to box
+    sandbox.assignment(box)
+    loc_context = manager.settings.contexts.location
+    loc_boxes = os.path.join(loc_context, manager.settings.containers.boxes)
+    environment = os.path.join(loc_context, sandbox.environment)
+    trash = os.path.join(
+        manager.location('containers'), 'trash',
+        '{0}-{1}'.format(sandbox.name, tracer.run)
+    )
+    moves = [
+        # 1. <env>.json file in boxes
+        (os.path.join(loc_boxes, sandbox.name + '.json'), 'box.json'),
+        # 2. <env>.yml, <env>.spec.yml and <env>.txt files in environments
+        (environment, 'environment.yml'),
+        (environment[:-len('.yml')] + '.spec.yml', 'environment.spec.yml'),
+        (environment[:-len('.yml')] + '.txt', 'environment.txt'),
+        (environment[:-len('.yml')] + '.requirements.lock', 'requirements.lock'),
+        # 3. profile_<[env]> folder in profiles/ipython
+        (os.path.join(loc_context, sandbox.profile), 'profile'),
+        # 4. repositories/<folder>
+        (os.path.join(loc_context, sandbox.location), 'repository'),
+        # 5. conda environment
+        (conda_prefix(sandbox.name), 'prefix')
+    ]
+    # attributes left empty would point to the context itself
+    moves = [
+        (source, target) for source, target in moves
+        if os.path.normpath(source) != os.path.normpath(loc_context)
+    ]
+    os.makedirs(trash)
+    moved = []
+    with folder_lock(loc_boxes):
+        try:
+            for source, target in moves:
+                if os.path.lexists(source):
+                    destiny = os.path.join(trash_location(source, trash), target)
+                    os.makedirs(os.path.dirname(destiny), exist_ok=True)
+                    os.rename(source, destiny)
+                    moved.append((source, destiny))
+        except OSError:
+            for source, destiny in reversed(moved):
+                os.rename(destiny, source)
+            for folder in set([trash] + [os.path.dirname(d) for s, d in moved]):
+                if os.path.isdir(folder) and not os.listdir(folder):
+                    os.rmdir(folder)
+            raise
+        manager.index.discard(sandbox.name)
+        manager.boxes.discard(sandbox.name)
+    return trash
+
+
+def spawn_reaper():
+    """
+    Start manage.py reap detached from the terminal
+    """
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'reap'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True,
+        env=dict(os.environ, LOC_SETTINGS=LOC_SETTINGS, LOC_CONDA=LOC_CONDA, LOC_DAEMON='0')
+    )
+
+
+def sweep_logs():
+    """
+    Delete the log folders of the runs older than [contexts] logs days and
+    rotate the traces when their first span is older, the previous ones are
+    kept in <traces>.1 so both files together span up to twice those days
+    """
+    limit = time.time() - float(manager.settings.contexts.get('logs', 7)) * 86400
+    loc_logs = os.path.join(manager.location('containers'), 'logs')
+    if os.path.isdir(loc_logs):
+        for entry in os.scandir(loc_logs):
+            if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < limit:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    try:
+        with open(tracer.filename, 'r') as infile:
+            first = json.loads(infile.readline() or '{}')
+    except (FileNotFoundError, ValueError):
+        return
+    if first.get('start', limit) < limit:
+        # writers holding the old file keep appending to <traces>.1
+        os.replace(tracer.filename, tracer.filename + '.1')
+
+
+def remove_tree(path):
+    """
+    shutil.rmtree of an entry of the trash, folders and files left without
+    write permission are made writable and removed again once
+    :return: True when path is gone
+    """
+    import stat
+
+    def retry(function, name, error):
+        try:
+            os.chmod(os.path.dirname(name), stat.S_IRWXU)
+            if os.path.isdir(name) and not os.path.islink(name):
+                os.chmod(name, stat.S_IRWXU)
+            function(name)
+        except OSError:
+            pass
+    if os.path.isdir(path) and not os.path.islink(path):
+        if sys.version_info >= (3, 12):
+            shutil.rmtree(path, onexc=retry)
+        else:
+            shutil.rmtree(path, onerror=retry)
+    elif os.path.lexists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return not os.path.lexists(path)
+
+
+def reap_trash(args=None, session=None):
+    """
+    Delete the content of every trash root with [containers] reapers threads,
+    then the old logs, a single reaper runs at a time. Entries that survive a
+    pass (immutable files, busy mounts) are reported and left for the next
+    reaper instead of being retried forever.
+    """
+    import fcntl
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        loc_trash = os.path.join(manager.location('containers'), 'trash')
+        os.makedirs(loc_trash, exist_ok=True)
+        with open(os.path.join(loc_trash, '.lock'), 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another reaper is already emptying the trash
+                return
+            workers = int(manager.settings.containers.get('reapers', 2))
+            stuck = set()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # new entries keep coming from the removes running meanwhile
+                while True:
+                    entries = [
+                        os.path.join(root, e) for root in trash_roots() if os.path.isdir(root)
+                        for e in os.listdir(root) if not e.startswith('.')
+                        and os.path.join(root, e) not in stuck
+                    ]
+                    if not entries:
+                        break
+                    for entry, removed in zip(entries, pool.map(remove_tree, entries)):
+                        if not removed:
+                            stuck.add(entry)
+            for entry in sorted(stuck):
+                sys.stderr.write('reap: {0} could not be deleted\n'.format(entry))
+            sweep_logs()
+    except Exception as Error:
+        raise Error
+
+
 def remove_box(args, session=None):
     try:
-        # search sandbox by name
-        name = args.name
-        box = manager.import_sandbox(name)
-        # build a box
-        sandbox = Box()
-        # assigned attributes from sandbox to box
-        sandbox.assignment(box)
-        #  1. Remove conda environment
-        response = conda_remove(sandbox.name)
-        # 2. Remove <env>.json file in boxes
-        os.remove(os.path.join(
-            os.path.join(
-                manager.settings.contexts.location,
-                manager.settings.containers.boxes
-            ),
-            sandbox.name + '.json'
-        ))
-        # 3. Remove <env>.yml file in environments
-        os.remove(os.path.join(
-            manager.settings.contexts.location,
-            sandbox.environment
-        ))
-        #  4. Remove profile__<[env]> folder in profiles/ipython
-        shutil.rmtree(os.path.join(
-            manager.settings.contexts.location,
-            sandbox.profile
-        ))
-        #  5. Remove repositories/<folder>
-        shutil.rmtree(os.path.join(
-            manager.settings.contexts.location,
-            sandbox.location
-        ))
+        # search sandboxes by name, glob pattern or all of them
+        if getattr(args, 'all', False):
+            names = manager.index.names()
+        elif getattr(args, 'pattern', None):
+            import fnmatch
+            names = fnmatch.filter(manager.index.names(), args.pattern)
+        else:
+            names = [args.name]
+        failed = []
+        for name in names:
+            try:
+                trash_box(name)
+                print('{0}: removed'.format(name))
+            except Exception as Error:
+                failed.append(name)
+                print('{0}: failed, {1}'.format(name, Error))
+        if getattr(args, 'wait', False):
+            reap_trash(args)
+        elif len(failed) < len(names):
+            spawn_reaper()
+        if failed:
+            raise ValueError('boxes not removed: {0}'.format(', '.join(failed)))
+    except Exception as Error:
+        raise Error
+
+
+def prefix_placeholders(prefix):
+    """
+    :param prefix: conda environment
+    :return: {relative path: 'text' or 'binary'} of the files holding the prefix
+    """
+    import glob
+    placeholders = {}
+    for filename in glob.glob(os.path.join(prefix, 'conda-meta', '*.json')):
+        with open(filename, 'r') as infile:
+            record = json.load(infile)
+        for path in record.get('paths_data', {}).get('paths', []):
+            if path.get('prefix_placeholder'):
+                placeholders[path['_path']] = path.get('file_mode', 'text')
+    return placeholders
+
+
+def relocate(content, old, new, mode):
+    """
+    Replace the prefix old by new as conda does when it links a package,
+    binaries keep the length of every string padding it with nulls
+    """
+    import re
+    if mode == 'text':
+        return content.replace(old, new)
+    if len(new) > len(old):
+        raise ValueError('prefix {0} is longer than {1}'.format(new, old))
+
+    def replace(match):
+        occurrences = match.group().count(old)
+        return match.group().replace(old, new) + b'\0' * ((len(old) - len(new)) * occurrences)
+    return re.sub(re.escape(old) + b'([^\0]*?)\0', replace, content)
+
+
+def snapshot_members(sandbox):
+    """
+    :return: [(folder in the archive, location)] of the box
+    """
+    loc_context = manager.settings.contexts.location
+    environment = os.path.join(loc_context, sandbox.environment)
+    members = [
+        ('prefix', conda_prefix(sandbox.name)),
+        ('profile', os.path.join(loc_context, sandbox.profile)),
+        ('repository', os.path.join(loc_context, sandbox.location))
+    ]
+    for filename in (environment, environment[:-len('.yml')] + '.spec.yml',
+                     environment[:-len('.yml')] + '.txt',
+                     environment[:-len('.yml')] + '.requirements.lock'):
+        members.append(('environments/' + os.path.basename(filename), filename))
+    return [
+        (arcname, location) for arcname, location in members
+        if os.path.normpath(location) != os.path.normpath(loc_context) and os.path.lexists(location)
+    ]
+
+
+def dissociate_repository(location):
+    """
+    Copy the objects a clone made with --reference-if-able borrows from the
+    mirror into its own pack and drop its alternates, the repository then
+    holds every object it needs on a machine without the mirror.
+    :param location: work tree of the repository
+    """
+    alternates = os.path.join(location, '.git', 'objects', 'info', 'alternates')
+    if os.path.isfile(alternates):
+        terminal.local('git -C {0} repack -a -d --quiet'.format(shlex.quote(location)), hide=True)
+        os.remove(alternates)
+
+
+def snapshot_box(args, session=None):
+    """
+    Zip of the box json, its environment prefix, profile, repository and
+    environment files, every file is streamed into the archive. Files
+    already compressed are stored, the rest deflated with [snapshots] level.
+    A repository borrowing objects of the mirror is made self-contained first.
+    """
+    import stat
+    import zipfile
+    try:
+        box = manager.import_sandbox(args.name)
+        if box.get('status') == 'failed':
+            raise ValueError('box {0} does not exist'.format(args.name))
+        sandbox = Box(instance=box)
+        output = args.output or os.path.join(
+            manager.location('containers'), 'snapshots', '{0}.zip'.format(sandbox.name)
+        )
+        level = int(manager.settings.get('snapshots', {}).get('level', 1))
+        stored = ('.zip', '.gz', '.bz2', '.xz', '.zst', '.whl', '.jpg', '.png', '.conda')
+        prefix = conda_prefix(sandbox.name)
+        if output == '-':
+            target = sys.stdout.buffer
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            target = open(output, 'wb')
+        with target, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as archive:
+            archive.writestr('snapshot.json', json.dumps({
+                'box': box,
+                'prefix': prefix,
+                'placeholders': prefix_placeholders(prefix),
+                'created': time.time()
+            }))
+            for folder, location in snapshot_members(sandbox):
+                if folder == 'repository':
+                    dissociate_repository(location)
+                walk = os.walk(location) if os.path.isdir(location) and not os.path.islink(location) \
+                    else [(os.path.dirname(location), [], [os.path.basename(location)])]
+                for root, dirs, files in walk:
+                    relative = os.path.relpath(root, location) if os.path.isdir(location) else '.'
+                    for name in sorted(dirs) + sorted(files):
+                        path = os.path.join(root, name)
+                        arcname = folder if not os.path.isdir(location) else \
+                            '/'.join(p for p in (folder, relative, name) if p != '.')
+                        status = os.lstat(path)
+                        info = zipfile.ZipInfo(arcname, time.localtime(status.st_mtime)[:6])
+                        info.external_attr = (status.st_mode & 0xFFFF) << 16
+                        if stat.S_ISLNK(status.st_mode):
+                            archive.writestr(info, os.readlink(path), zipfile.ZIP_STORED)
+                        elif stat.S_ISDIR(status.st_mode):
+                            info.filename += '/'
+                            archive.writestr(info, b'', zipfile.ZIP_STORED)
+                        elif stat.S_ISREG(status.st_mode):
+                            info.file_size = status.st_size
+                            info.compress_type = zipfile.ZIP_STORED if name.endswith(stored) \
+                                else zipfile.ZIP_DEFLATED
+                            info._compresslevel = level
+                            with open(path, 'rb') as infile, archive.open(info, 'w', force_zip64=True) as outfile:
+                                shutil.copyfileobj(infile, outfile, 1 << 20)
+        if output != '-':
+            print('{0}: {1}'.format(sandbox.name, output))
+    except Exception as Error:
+        raise Error
+
+
+def restore_box(args, session=None):
+    """
+    Unpack a snapshot with [snapshots] workers threads into temporary
+    folders renamed into place at the end, the files holding the prefix of
+    the original environment are relocated to the prefix of this machine.
+    """
+    import stat
+    import zipfile
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with zipfile.ZipFile(args.file, 'r') as archive:
+            snapshot = json.loads(archive.read('snapshot.json'))
+            infos = [i for i in archive.infolist() if i.filename != 'snapshot.json']
+        sandbox = Box(instance=snapshot['box'])
+        sandbox.host = ''
+        if manager.index.load(sandbox.name):
+            raise ValueError('box {0} already exists'.format(sandbox.name))
+        loc_context = manager.settings.contexts.location
+        destinations = {
+            'prefix': conda_prefix(sandbox.name),
+            'profile': os.path.join(loc_context, sandbox.profile),
+            'repository': os.path.join(loc_context, sandbox.location),
+            'environments': manager.location('environments')
+        }
+        for destination in destinations.values():
+            if os.path.lexists(destination) and destination != destinations['environments']:
+                raise ValueError('{0} already exists'.format(destination))
+        staging = dict(
+            (folder, '{0}.{1}.part'.format(destination, tracer.run))
+            for folder, destination in destinations.items() if folder != 'environments'
+        )
+        staging['environments'] = destinations['environments']
+        old = snapshot['prefix'].encode('utf8')
+        new = destinations['prefix'].encode('utf8')
+        placeholders = snapshot['placeholders']
+
+        def target(info):
+            folder, _, relative = info.filename.rstrip('/').partition('/')
+            if folder == 'environments':
+                return os.path.join(staging[folder], relative), None
+            return os.path.join(staging[folder], relative), relative if folder == 'prefix' else None
+
+        # 1. folders, created before the files, modes applied at the end
+        folders = [i for i in infos if i.filename.endswith('/')]
+        for info in folders:
+            os.makedirs(target(info)[0], exist_ok=True)
+        local = threading.local()
+
+        def extract(info):
+            if not hasattr(local, 'archive'):
+                local.archive = zipfile.ZipFile(args.file, 'r')
+            path, relative = target(info)
+            mode = info.external_attr >> 16
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if stat.S_ISLNK(mode):
+                os.symlink(local.archive.read(info).decode('utf8'), path)
+                return
+            with local.archive.open(info, 'r') as infile, open(path, 'wb') as outfile:
+                if relative in placeholders and old != new:
+                    outfile.write(relocate(infile.read(), old, new, placeholders[relative]))
+                elif relative is not None and relative.startswith('bin/') and old != new:
+                    # entry points written by pip keep the prefix in their shebang
+                    head = infile.readline()
+                    outfile.write(head.replace(old, new) if head.startswith(b'#!') else head)
+                    shutil.copyfileobj(infile, outfile, 1 << 20)
+                else:
+                    shutil.copyfileobj(infile, outfile, 1 << 20)
+            if mode:
+                os.chmod(path, stat.S_IMODE(mode))
+
+        # 2. files and symlinks in parallel, each thread with its own handle
+        workers = int(args.workers or manager.settings.get('snapshots', {}).get('workers', os.cpu_count() or 4))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(extract, [i for i in infos if not i.filename.endswith('/')]))
+            for info in reversed(folders):
+                mode = info.external_attr >> 16
+                if mode:
+                    os.chmod(target(info)[0], stat.S_IMODE(mode))
+        except BaseException:
+            for folder, location in staging.items():
+                if folder != 'environments':
+                    shutil.rmtree(location, ignore_errors=True)
+            raise
+
+        # 3. into place, then the box is registered
+        for folder, location in staging.items():
+            if folder != 'environments' and os.path.lexists(location):
+                os.makedirs(os.path.dirname(destinations[folder]), exist_ok=True)
+                os.rename(location, destinations[folder])
+        box = sandbox.retrieve()
+        print('{0}: {1}'.format(sandbox.name, manager.register_sandbox(box)['status']))
     except Exception as Error:
         raise Error
 
@@ -607,12 +3328,14 @@ def setup_container(args=None, session=None):
 
 def sync_box(args, session=None):
     try:
+        if getattr(args, 'manifest', None):
+            return sync_manifest(args, session)
         if args.name and not args.repository and not args.environment:
             # Instanciamos sandbox
             instance = True
-            sandboxes = manager.retrieve_sandboxes()
-            box = [ box for box in sandboxes['containers'] if box['sandbox']['name'].lower() == args.name.lower() ]
-            sandbox = Box(instance=box.pop())
+            sandbox = Box(instance=manager.import_sandbox(args.name))
+            args.environment = sandbox.name
+            args.language = args.language or sandbox.language
         elif not args.name and args.repository and args.environment:
             # Creamos sandbox
             instance = False
@@ -620,28 +3343,155 @@ def sync_box(args, session=None):
             sandbox.name = args.environment
             sandbox.language = args.language
             sandbox.repository = args.repository
-        # 1 clonamos repositorio
-        clone = git_clone(sandbox.repository)
-        # 2. crear environment con conda y exporta yml environments/conda (OK)
-        sync_env = conda_sync(clone, args)
-        # 3. crear profile en ipython en carpeta correspondiente (OK)
-        build_profile = profile_build(sandbox.name)
+        tracer.label(box=sandbox.name, language=sandbox.language)
+        steps = [
+            # 1 clonamos repositorio
+            Step('repository', lambda r: git_clone(sandbox.repository), resource='clone'),
+            # 2. crear environment con conda y exporta yml environments/conda (OK)
+            Step(
+                'environment', lambda r: conda_sync(r['repository'], args, sandbox.hashes),
+                requires=['repository'], resource='solve'
+            ),
+            # 3. crear profile en ipython en carpeta correspondiente (OK)
+            Step('profile', lambda r: profile_sync(sandbox, r['environment']), requires=['environment'])
+        ]
         # 4. crear archivo <box>.json y guardarlo en carpeta containers/boxes (OK)
         if not instance:
-            response = clean_response({
-                'repository': clone, 'environment': sync_env, 'profile': build_profile
-            })
-            sandbox.update(response)
-            # 5. Export metadata to json file in boxes folder
-            box = sandbox.retrieve()
-            response = manager.registry(box)
-            status = manager.export_sandbox(box)
-            print(status)
+            steps.append(Step(
+                'response', clean_response, requires=['repository', 'environment', 'profile']
+            ))
+        scheduler = Scheduler(steps)
+        with manager.hosts.place(sandbox.host or None) as host:
+            sandbox.host = host
+            tracer.label(host=host)
+            results = scheduler.run()
+        scheduler.raise_for_status(results)
+        if not results['environment']['output']['changed']:
+            return 'unchanged'
+        sandbox.hashes = results['environment']['output']['hashes']
+        if not instance:
+            sandbox.update(results['response'])
+        # 5. Export metadata to json file in boxes folder
+        box = sandbox.retrieve()
+        if session is not None:
+            session.add(box)
+            return 'updated' if instance else 'created'
+        print(manager.register_sandbox(box))
+        return 'updated' if instance else 'created'
+    except Exception as Error:
+        raise Error
+
+
+def profile_sync(sandbox, environment):
+    """
+    :param sandbox: Box
+    :param environment: response of conda_sync
+    :return: response of profile_build, skipped when the profile exists
+    """
+    loc_export = manager.location('profiles')
+    iprofile = '[{name}]'.format(name=sandbox.name)
+    if not os.path.isdir(
+        os.path.join(loc_export, 'profile_{0}'.format(iprofile))
+    ):
+        return profile_build(sandbox.name)
+    return generate_response({'ok': True, 'command': None}, {
+        'env': sandbox.name,
+        'profile': iprofile,
+        'export': loc_export
+    })
+
+
+def load_manifest(filename):
+    """
+    :param filename: yml with a list of {repository, environment, language, packages}
+    :return: [Args]
+    """
+    import yaml
+    with open(filename, 'r') as infile:
+        manifest = yaml.safe_load(infile) or []
+    if isinstance(manifest, dict):
+        manifest = manifest.get('boxes', [])
+    entries, names = [], set()
+    for number, entry in enumerate(manifest, 1):
+        entry = dict(entry)
+        missing = [k for k in ('repository', 'environment', 'language') if not entry.get(k)]
+        if missing:
+            raise ValueError('entry {0} of {1} without {2}'.format(
+                number, filename, ', '.join(missing)
+            ))
+        if entry['environment'] in names:
+            raise ValueError('environment {0} is repeated in {1}'.format(
+                entry['environment'], filename
+            ))
+        names.add(entry['environment'])
+        args = Args()
+        args.name = None
+        args.repository = verify_url(entry['repository'])
+        args.environment = entry['environment']
+        args.language = languages(entry['language'])
+        args.packages = entry.get('packages')
+        entries.append(args)
+    return entries
+
+
+def sync_manifest(args, session=None):
+    """
+    sync every box of args.manifest with args.workers threads, at most
+    args.clones clones and args.solves conda solves at the same time
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        entries = load_manifest(args.manifest)
+        manager.limits['clone'] = threading.BoundedSemaphore(args.clones)
+        manager.limits['solve'] = threading.BoundedSemaphore(args.solves)
+        batch = RegistrySession() if session is None else session
+
+        def run(entry):
+            start = time.time()
+            if manager.index.get('name', entry.environment):
+                # existing box, incremental sync by name
+                existing = Args()
+                existing.name = entry.environment
+                existing.repository = existing.environment = None
+                existing.language = entry.language
+                existing.packages = entry.packages
+                entry = existing
+            try:
+                status = sync_box(entry, session=batch)
+                return status, time.time() - start, ''
+            except Exception as Error:
+                return 'failed', time.time() - start, str(Error).splitlines()[0][:80]
+
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(run, entries))
+        registry = batch.commit() if session is None else {}
+        rows = [('environment', 'language', 'status', 'seconds', 'detail')]
+        for entry, (status, seconds, detail) in zip(entries, results):
+            registry_status = registry.get(entry.environment, {}).get('status')
+            if status in ('created', 'updated') and registry_status != 'successful':
+                status, detail = 'failed', 'registry: {0}'.format(registry_status)
+            rows.append((
+                entry.environment, entry.language, status, '{0:.1f}'.format(seconds), detail
+            ))
+        widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            print('  '.join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip())
+        return results
     except Exception as Error:
         raise Error
 
 
 def run_subprocess(sandbox):
+    """
+    Open the box with [kernels] backend, tmux by default on linux and a
+    macOS Terminal window otherwise
+    """
+    kernels = manager.settings.get('kernels', {})
+    backend = kernels.get('backend') or ('tmux' if sys.platform.startswith('linux') else 'terminal')
+    if backend == 'tmux':
+        return attach_kernel(sandbox)
+    if backend != 'terminal':
+        raise ValueError('kernel backend {0} is not supported'.format(backend))
     response = subprocess.run("""
         osascript -e 'tell app "Terminal"' -e 'do script "cd {repositories} && conda activate {environment} && ipython --profile=[{profile}] --ipython-dir={loc_profiles}"' -e 'end tell'
     """.format(
@@ -659,6 +3509,163 @@ def run_subprocess(sandbox):
     return response
 
 
+def tmux(*args, **kwargs):
+    """
+    tmux on the server of the kernels, <containers>/kernels.sock
+    """
+    return subprocess.run(
+        ['tmux', '-S', os.path.join(manager.location('containers'), 'kernels.sock')] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, **kwargs
+    )
+
+
+def kernel_session(name):
+    # tmux does not allow . and : in session names
+    return 'box-' + name.replace('.', '_').replace(':', '_')
+
+
+def attach_kernel(sandbox):
+    """
+    Start the IPython of the box in a tmux session once, later starters
+    attach to the running kernel
+    """
+    session = kernel_session(sandbox.name)
+    if tmux('has-session', '-t', session).returncode != 0:
+        command = [
+            LOC_CONDA, 'run', '--no-capture-output', '-n', sandbox.name,
+            'ipython', '--profile=[{0}]'.format(sandbox.name),
+            '--ipython-dir={0}'.format(manager.location('profiles'))
+        ]
+        response = tmux(
+            'new-session', '-d', '-s', session,
+            '-c', os.path.join(manager.settings.contexts.location, sandbox.location),
+            shlex.join(command)
+        )
+        if response.returncode != 0:
+            raise ValueError('kernel of {0} not started: {1}'.format(sandbox.name, response.stderr.strip()))
+        spawn_watcher()
+    if not sys.stdin.isatty():
+        print('{0}: running in tmux session {1}'.format(sandbox.name, session))
+        return None
+    socket = os.path.join(manager.location('containers'), 'kernels.sock')
+    os.execvp('tmux', ['tmux', '-S', socket, 'attach-session', '-t', session])
+
+
+def process_rss(pid):
+    """
+    :return: resident memory in bytes of pid and its descendants
+    """
+    total, pending = 0, [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open('/proc/{0}/status'.format(pid), 'r') as infile:
+                for line in infile:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir('/proc/{0}/task'.format(pid)):
+                with open('/proc/{0}/task/{1}/children'.format(pid, task), 'r') as infile:
+                    pending.extend(int(child) for child in infile.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def list_kernels():
+    """
+    :return: [{'session', 'activity', 'attached', 'rss'}] least recently used first
+    """
+    response = tmux(
+        'list-sessions', '-F',
+        '#{session_name} #{session_activity} #{session_attached} #{pane_pid}'
+    )
+    kernels = []
+    for line in response.stdout.splitlines() if response.returncode == 0 else []:
+        session, activity, attached, pid = line.split()
+        if session.startswith('box-'):
+            kernels.append({
+                'session': session,
+                'activity': int(activity),
+                'attached': int(attached),
+                'rss': process_rss(int(pid))
+            })
+    return sorted(kernels, key=lambda k: k['activity'])
+
+
+def enforce_kernels():
+    """
+    Stop the kernels without clients idle for more than [kernels] idle
+    seconds, then the least recently used ones while all the kernels use
+    more than [kernels] memory
+    :return: sessions stopped
+    """
+    settings = manager.settings.get('kernels', {})
+    idle = float(settings.get('idle', 3600))
+    memory = parse_size(settings.get('memory', 0))
+    kernels, stopped, now = list_kernels(), [], time.time()
+    for kernel in kernels:
+        if idle and not kernel['attached'] and now - kernel['activity'] > idle:
+            stopped.append(kernel)
+    total = sum(k['rss'] for k in kernels if k not in stopped)
+    for kernel in kernels:
+        if not memory or total <= memory:
+            break
+        if kernel not in stopped and not kernel['attached']:
+            stopped.append(kernel)
+            total -= kernel['rss']
+    for kernel in stopped:
+        tmux('kill-session', '-t', kernel['session'])
+    return [k['session'] for k in stopped]
+
+
+def spawn_watcher():
+    """
+    Start manage.py kernels --watch detached from the terminal
+    """
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'kernels', '--watch'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True,
+        env=dict(os.environ, LOC_SETTINGS=LOC_SETTINGS, LOC_CONDA=LOC_CONDA, LOC_DAEMON='0')
+    )
+
+
+def kernels_box(args, session=None):
+    """
+    List the running kernels, stop one with --stop or keep applying the
+    idle and memory limits with --watch while there are kernels
+    """
+    import fcntl
+    try:
+        if args.stop:
+            tmux('kill-session', '-t', kernel_session(args.stop))
+        elif args.watch:
+            with open(os.path.join(manager.location('containers'), 'kernels.lock'), 'a') as handle:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # another watcher is already running
+                    return
+                interval = float(manager.settings.get('kernels', {}).get('interval', 60))
+                while True:
+                    enforce_kernels()
+                    if not list_kernels():
+                        break
+                    time.sleep(interval)
+            return
+        for session in enforce_kernels():
+            print('{0}: stopped'.format(session))
+        now = time.time()
+        for kernel in list_kernels():
+            print('{0:<24} {1:>8.0f}s idle {2:>10} {3}'.format(
+                kernel['session'], now - kernel['activity'],
+                '{0:.1f}M'.format(kernel['rss'] / 1024.0 ** 2),
+                'attached' if kernel['attached'] else ''
+            ).rstrip())
+    except Exception as Error:
+        raise Error
+
+
 def starter_box(args, session=None):
     try:
         name = args.name
@@ -674,28 +3681,237 @@ def starter_box(args, session=None):
 
 
 def retrieve_sandboxes(args=None, session=None):
+    """
+    Print the boxes as they come out of the index, one document per line
+    with --format jsonl, otherwise the {'containers': [...]} document
+    """
     try:
-        sandboxes = manager.retrieve_sandboxes()
-        if args.name:
-            sandbox = [
-                c['sandbox'] for c in sandboxes['containers'] if c['sandbox']['name'] == args.name
-            ]
+        options = (args.where, args.fields, args.limit, args.offset, args.sort != 'name')
+        if args.name and not any(c in args.name for c in '*?[') and not any(options) \
+                and args.format == 'json':
+            sandbox = [manager.import_sandbox(args.name)['sandbox']]
             print(json.dumps(sandbox, indent=4, sort_keys=True))
-        else:
-            print(json.dumps(sandboxes, indent=4, sort_keys=True))
+            return
+        where = list(args.where or [])
+        if args.name:
+            where.append(('name', '=', args.name))
+        boxes = manager.index.query(
+            where, args.fields, args.sort, args.limit, args.offset or 0
+        )
+        if args.format == 'jsonl':
+            for box in boxes:
+                sys.stdout.write(json.dumps(box, sort_keys=True) + '\n')
+            return
+        # same text as json.dumps({'containers': [...]}, indent=4), written box by box
+        sys.stdout.write('{\n    "containers": [')
+        separator = '\n'
+        for box in boxes:
+            text = json.dumps(box, indent=4, sort_keys=True)
+            sys.stdout.write(separator + '\n'.join(' ' * 8 + line for line in text.split('\n')))
+            separator = ',\n'
+        sys.stdout.write('\n    ]\n}\n' if separator == ',\n' else ']\n}\n')
+    except Exception as Error:
+        raise Error
+
+
+def stats_traces(args=None, session=None):
+    """
+    p50/p95 of the recorded steps, by step and by step and language
+    """
+    try:
+        since = time.time() - args.days * 86400 if args.days else 0
+        groups = {}
+        for span in tracer.read():
+            if span['start'] < since or (args.step and span['step'] != args.step):
+                continue
+            for key in ((span['step'], '*'), (span['step'], span.get('language') or '-')):
+                groups.setdefault(key, []).append(span)
+        rows = [('step', 'language', 'count', 'failed', 'p50', 'p95')]
+        for (step, language), spans in sorted(groups.items()):
+            durations = sorted(s['duration'] for s in spans)
+            rows.append((
+                step, language, len(spans),
+                len([s for s in spans if s['status'] != 'successful']),
+                '{0:.2f}s'.format(percentile(durations, 50)),
+                '{0:.2f}s'.format(percentile(durations, 95))
+            ))
+        widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            print('  '.join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip())
+    except Exception as Error:
+        raise Error
+
+
+def daemon_socket():
+    """
+    Read from the settings file alone, the client must not build the manager
+    to find out whether a daemon already holds one.
+    :return: [containers] socket, <containers>/manage.sock by default,
+        None when the settings cannot tell
+    """
+    settings = ConfigParser()
+    try:
+        settings.read(LOC_SETTINGS)
+        return os.path.join(
+            settings.get('contexts', 'location'),
+            settings.get('containers', 'location'),
+            settings.get('containers', 'socket', fallback='manage.sock')
+        )
+    except Exception:
+        return None
+
+
+def forward_daemon(argv):
+    """
+    Run argv in the daemon, its stdout and stderr are written here as they
+    arrive. The request is a json line {argv, cwd, settings, conda}, the
+    answer json lines {stdout} or {stderr} ended by {exited}.
+    :return: exit code, None when there is no daemon or it is busy
+    """
+    import socket
+    location = daemon_socket()
+    if location is None:
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(location)
+    except OSError:
+        client.close()
+        return None
+    with client, client.makefile('rwb') as channel:
+        channel.write(json.dumps({
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'settings': os.path.abspath(LOC_SETTINGS),
+            'conda': LOC_CONDA
+        }).encode('utf8') + b'\n')
+        channel.flush()
+        for line in channel:
+            message = json.loads(line)
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+                sys.stdout.flush()
+            elif 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+                sys.stderr.flush()
+            elif 'exited' in message:
+                return message['exited']
+    # daemon busy, stopped or serving another context
+    return None
+
+
+def serve_daemon(args=None, session=None):
+    """
+    Keep settings, registry, executor and caches in memory and run the
+    commands sent to <containers>/manage.sock. One command runs at a time,
+    a client arriving meanwhile is told to run in its own process.
+    """
+    import socket
+    import socketserver
+    import traceback
+
+    busy = threading.Lock()
+    loaded = {'settings': os.stat(LOC_SETTINGS).st_mtime_ns}
+
+    class ChannelWriter(io.TextIOBase):
+        def __init__(self, channel, stream):
+            super().__init__()
+            self.channel = channel
+            self.stream = stream
+
+        def write(self, data):
+            if data:
+                self.channel.write(json.dumps({self.stream: data}).encode('utf8') + b'\n')
+                self.channel.flush()
+            return len(data)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline() or 'null')
+            if not request or request.get('stop'):
+                if request:
+                    threading.Thread(target=self.server.shutdown).start()
+                return
+            if request['settings'] != os.path.abspath(LOC_SETTINGS) or request['conda'] != LOC_CONDA:
+                return
+            if not busy.acquire(blocking=False):
+                return
+            try:
+                self.execute(request)
+            finally:
+                busy.release()
+
+        def execute(self, request):
+            mtime = os.stat(LOC_SETTINGS).st_mtime_ns
+            if mtime != loaded['settings']:
+                # settings.ini changed, rebuild the manager, the executor and
+                # the github client
+                manager.__dict__['_instance'] = None
+                terminal.__dict__['_instance'] = None
+                github.__dict__['_instance'] = None
+                loaded['settings'] = mtime
+            elif manager.__dict__['_instance'] is not None:
+                # commands may have run in their own process meanwhile, the
+                # on-disk index is the reference and the table starts empty
+                manager.__dict__['_instance'].boxes = BoxTable()
+            tracer.start()
+            exited, cwd = 0, os.getcwd()
+            stdout = ChannelWriter(self.wfile, 'stdout')
+            stderr = ChannelWriter(self.wfile, 'stderr')
+            try:
+                os.chdir(request['cwd'])
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    try:
+                        main(request['argv'], forward=False)
+                    except SystemExit as Error:
+                        exited = Error.code if isinstance(Error.code, int) else 1
+                    except Exception:
+                        traceback.print_exc()
+                        exited = 1
+            finally:
+                os.chdir(cwd)
+            self.wfile.write(json.dumps({'exited': exited}).encode('utf8') + b'\n')
+
+    try:
+        location = daemon_socket()
+        if location is None:
+            raise ValueError('settings was not found')
+        if args.stop:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with client:
+                client.connect(location)
+                client.sendall(json.dumps({'stop': True}).encode('utf8') + b'\n')
+            return
+        if os.path.exists(location):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with client:
+                try:
+                    client.connect(location)
+                except OSError:
+                    # left by a daemon which did not stop cleanly
+                    os.remove(location)
+                else:
+                    raise ValueError('a daemon is already serving {0}'.format(location))
+        server = socketserver.ThreadingUnixStreamServer(location, Handler)
+        server.daemon_threads = True
+        os.chmod(location, 0o600)
+        print('serving {0}'.format(location))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(location)
     except Exception as Error:
         raise Error
 
 
 def get_containers():
-    sandboxes = manager.retrieve_sandboxes()
-    containers = [ c['sandbox']['name'] for c in sandboxes['containers'] if c ]
+    containers = manager.index.names()
     return containers
 
 
 def verify_available_sandbox(name):
-    containers = get_containers()
-    if name in containers:
+    if manager.index.get('name', name):
         raise argparse.ArgumentTypeError(
             'The Container it was created, please introduce a new name.'
         )
@@ -703,8 +3919,7 @@ def verify_available_sandbox(name):
 
 
 def verify_name_sandbox(name):
-    containers = get_containers()
-    if name in containers:
+    if manager.index.get('name', name):
         return name
     else:
         raise argparse.ArgumentTypeError(
@@ -712,93 +3927,193 @@ def verify_name_sandbox(name):
         )
 
 
+def verify_name_pattern(name):
+    """
+    Names with * ? [ are globs matched by the query, others must exist
+    """
+    if any(c in name for c in '*?['):
+        return name
+    return verify_name_sandbox(name)
+
+
+def verify_field(field):
+    """
+    :param field: _id or a sandbox field, -field for --sort
+    """
+    known = ['_id'] + Box.attrs
+    if field.strip().lstrip('-') not in known:
+        raise argparse.ArgumentTypeError('field {0} is not one of {1}'.format(field, ', '.join(known)))
+    return field.strip()
+
+
+def verify_fields(fields):
+    return [verify_field(f) for f in fields.split(',') if f.strip()]
+
+
+def verify_where(expression):
+    """
+    :param expression: field=value or field!=value
+    :return: (field, operator, value)
+    """
+    for operator in ('!=', '='):
+        field, found, value = expression.partition(operator)
+        if found and field:
+            field, value = verify_field(field), value.strip()
+            if field == '_id' and not value.lstrip('-').isdigit():
+                raise argparse.ArgumentTypeError('_id {0} is not an integer'.format(value))
+            return field, operator, value
+    raise argparse.ArgumentTypeError('{0} is not field=value'.format(expression))
+
+
 def verify_url(direction):
+    import validators
     response = validators.url(direction)
     if not response:
         raise argparse.ArgumentTypeError('The URL provided was not correct.')
     return direction
 
 
-#  engine = create_engine(
-#      manager.settings.contexts.connection,
-#      echo=bool(manager.settings.contexts.echo)
-#  )
-#  Session = sessionmaker(bind=engine)
-#  session = Session()
+LOC_SETTINGS = os.environ.get(
+    'LOC_SETTINGS', '/Users/lurangar/Documents/lmokto/containers/settings.ini'
+)
+LOC_CONDA = os.environ.get('LOC_CONDA', '/Library/anaconda3/condabin/conda')
 
-LOC_SETTINGS = '/Users/lurangar/Documents/lmokto/containers/settings.ini'
-LOC_CONDA = '/Library/anaconda3/condabin/conda'
+manager = Lazy(lambda: ManagerContext(LOC_SETTINGS))
+terminal = Placed(connect_executor)
+github = Lazy(connect_github)
+tracer = Tracer()
+filesystem = InProcessExecutor()
 
-manager = ManagerContext(LOC_SETTINGS)
-terminal = fabric.Connection(manager.settings.contexts.pipeline)
 
-LOC_CONTEXT = manager.settings.contexts.location
+def main(argv=None, forward=True):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', action='store_true', help='print a waterfall of the steps')
+    subparsers = parser.add_subparsers()
 
-LOC_CONTAINERS = os.path.join(
-    LOC_CONTEXT,
-    manager.settings.containers.location
-)
+    # 1.1 python manage.py starter_container
+    parser_active = subparsers.add_parser('setup', help='start container context')
+    parser_active.set_defaults(func=setup_container)
 
-LOC_REPOSITORIES = os.path.join(
-    LOC_CONTEXT,
-    manager.settings.repositories.location
-)
+    # 2.1 python manage.py create --name='test' --language='python3.6' --packages='ipython pip'
+    parser_registry = subparsers.add_parser('create', help='')
+    parser_registry.add_argument('-n', '--name', required=True, type=verify_available_sandbox, help='')
+    parser_registry.add_argument('-l', '--language', type=languages, required=True, help='')
+    parser_registry.add_argument('-g', '--git', required=False, type=str2bool, default=True, help='')
+    parser_registry.add_argument('-p', '--packages', required=False, help='', default='ipython pip')
+    parser_registry.set_defaults(func=create_box)
 
-LOC_PROFILES = os.path.join(
-    LOC_CONTEXT,
-    manager.settings.profiles.location
-)
+    # 3.1 python manage.py remove --name=microdevices
+    # 3.2 python manage.py remove --pattern='micro*'
+    # 3.3 python manage.py remove --all
+    parser_registry = subparsers.add_parser('remove', help='')
+    group = parser_registry.add_mutually_exclusive_group(required=True)
+    group.add_argument('-n', '--name', type=verify_name_sandbox, help='')
+    group.add_argument('--pattern', help='glob on the box names')
+    group.add_argument('--all', action='store_true', help='')
+    parser_registry.add_argument('--wait', action='store_true', help='delete the data before returning')
+    parser_registry.set_defaults(func=remove_box)
+
+    # 3.4 python manage.py reap, empties the trash left by remove
+    parser_registry = subparsers.add_parser('reap', help='')
+    parser_registry.set_defaults(func=reap_trash)
+
+    # 4.1 python manage.py sync --repository=https://github.com/lmokto/microdevices.git --environment=microdevices --language=python3.6
+    # 4.2 python manage.py sync --name=will --language=python3.6
+    # 4.3 python manage.py sync --repository=https://github.com/lmokto/microdevices.git --language=python3.6
+    # 4.4 python manage.py sync --manifest=boxes.yml --clones=4 --solves=2
+    parser_registry = subparsers.add_parser('sync', help='')
+    parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=False, help='')
+    parser_registry.add_argument('-r', '--repository', type=verify_url, required=False, help='')
+    parser_registry.add_argument('-e', '--environment', type=verify_available_sandbox, required=False, help='')
+    parser_registry.add_argument('-l', '--language', type=languages, required=False, help='')
+    parser_registry.add_argument('-p', '--packages', required=False, help='')
+    parser_registry.add_argument('-m', '--manifest', required=False, help='yml with repository/environment/language entries')
+    parser_registry.add_argument('-w', '--workers', type=int, required=False, default=8, help='boxes synced at the same time')
+    parser_registry.add_argument('--clones', type=int, required=False, default=4, help='concurrent git clones')
+    parser_registry.add_argument('--solves', type=int, required=False, default=2, help='concurrent conda solves')
+    parser_registry.set_defaults(func=sync_box)
+
+    # 4.5 python manage.py pool, refills in the background
+    # 4.6 python manage.py pool --wait
+    # 4.7 python manage.py pool --drain
+    parser_registry = subparsers.add_parser('pool', help='idle environments claimed by create')
+    parser_registry.add_argument('--wait', action='store_true', help='refill before returning')
+    parser_registry.add_argument('--drain', action='store_true', help='remove the idle environments')
+    parser_registry.set_defaults(func=pool_box)
+
+    # 5.1 python manage.py starter --name='test'
+    parser_registry = subparsers.add_parser('starter', help='')
+    parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=True, help='')
+    parser_registry.set_defaults(func=starter_box)
+
+    # 5.2 python manage.py kernels
+    # 5.3 python manage.py kernels --stop=test
+    parser_registry = subparsers.add_parser('kernels', help='running kernels of starter')
+    parser_registry.add_argument('--stop', type=verify_name_sandbox, required=False, help='')
+    parser_registry.add_argument('--watch', action='store_true', help='apply [kernels] idle and memory until none runs')
+    parser_registry.set_defaults(func=kernels_box)
+
+    # 6.1 python manage.py retrieve
+    # 6.2 python manage.py retrieve --name=will
+    # 6.3 python manage.py retrieve --name='ml-*' --where language=python3.6 --fields name,version
+    # 6.4 python manage.py retrieve --sort=-version --limit=20 --offset=40 --format=jsonl
+    parser_registry = subparsers.add_parser('retrieve', help='')
+    parser_registry.add_argument('-n', '--name', type=verify_name_pattern, required=False, help='name or glob')
+    parser_registry.add_argument('-w', '--where', type=verify_where, action='append', required=False, help='field=value, repeatable')
+    parser_registry.add_argument('--fields', type=verify_fields, required=False, help='comma separated fields')
+    parser_registry.add_argument('--sort', type=verify_field, required=False, default='name', help='field or -field')
+    parser_registry.add_argument('--limit', type=int, required=False, help='')
+    parser_registry.add_argument('--offset', type=int, required=False, help='')
+    parser_registry.add_argument('--format', choices=['json', 'jsonl'], required=False, default='json', help='')
+    parser_registry.set_defaults(func=retrieve_sandboxes)
+
+    # 7.1 python manage.py stats
+    # 7.2 python manage.py stats --step=conda_build --days=7
+    parser_registry = subparsers.add_parser('stats', help='p50/p95 of past steps')
+    parser_registry.add_argument('-s', '--step', required=False, help='')
+    parser_registry.add_argument('-d', '--days', type=float, required=False, help='')
+    parser_registry.set_defaults(func=stats_traces)
+
+    # 8.1 python manage.py daemon
+    # 8.2 python manage.py daemon --stop
+    parser_registry = subparsers.add_parser('daemon', help='serve the commands over a unix socket')
+    parser_registry.add_argument('--stop', action='store_true', help='')
+    parser_registry.set_defaults(func=serve_daemon)
+
+    # 9.1 python manage.py snapshot --name=test --output=test.zip
+    # 9.2 python manage.py restore --file=test.zip
+    parser_registry = subparsers.add_parser('snapshot', help='archive a box to restore it without solving')
+    parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=True, help='')
+    parser_registry.add_argument('-o', '--output', required=False, help='zip file, - for stdout')
+    parser_registry.set_defaults(func=snapshot_box)
+
+    parser_registry = subparsers.add_parser('restore', help='unpack a snapshot')
+    parser_registry.add_argument('-f', '--file', required=True, help='zip file')
+    parser_registry.add_argument('-w', '--workers', type=int, required=False, help='')
+    parser_registry.set_defaults(func=restore_box)
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        argv = ['--help']
+
+    # starter attaches to the terminal, it always runs in this process,
+    # help needs no settings at all
+    if forward and argv[0] not in ('daemon', 'starter') \
+            and not {'-h', '--help'} & set(argv) \
+            and os.environ.get('LOC_DAEMON', '1') != '0':
+        exited = forward_daemon(argv)
+        if exited:
+            sys.exit(exited)
+        if exited is not None:
+            return
+
+    options = parser.parse_args(argv)
+    try:
+        options.func(options, session=None)
+    finally:
+        if options.trace:
+            tracer.waterfall()
 
-LOC_ENVIRONMENTS = os.path.join(
-    LOC_CONTEXT,
-    manager.settings.environments.location
-)
 
-parser = argparse.ArgumentParser()
-subparsers = parser.add_subparsers()
-
-# 1.1 python manage.py starter_container
-parser_active = subparsers.add_parser('setup', help='start container context')
-parser_active.set_defaults(func=setup_container)
-
-# 2.1 python manage.py create --name='test' --language='python3.6' --packages='ipython pip'
-parser_registry = subparsers.add_parser('create', help='')
-parser_registry.add_argument('-n', '--name', required=True, type=verify_available_sandbox, help='')
-parser_registry.add_argument('-l', '--language', type=languages, required=True, help='')
-parser_registry.add_argument('-g', '--git', required=False, type=str2bool, default=True, help='')
-parser_registry.add_argument('-p', '--packages', required=False, help='', default='ipython pip')
-parser_registry.set_defaults(func=create_box)
-
-# 3.1 python manage.py remove --name=microdevices
-parser_registry = subparsers.add_parser('remove', help='')
-parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=True, help='')
-parser_registry.set_defaults(func=remove_box)
-
-# 4.1 python manage.py sync --repository=https://github.com/lmokto/microdevices.git --environment=microdevices --language=python3.6
-# 4.2 python manage.py sync --name=will --language=python3.6
-# 4.3 python manage.py sync --repository=https://github.com/lmokto/microdevices.git --language=python3.6
-parser_registry = subparsers.add_parser('sync', help='')
-parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=False, help='')
-parser_registry.add_argument('-r', '--repository', type=verify_url, required=False, help='')
-parser_registry.add_argument('-e', '--environment', type=verify_available_sandbox, required=False, help='')
-parser_registry.add_argument('-l', '--language', type=languages, required=False, help='')
-parser_registry.add_argument('-p', '--packages', required=False, help='')
-parser_registry.set_defaults(func=sync_box)
-
-# 5.1 python manage.py starter --name='test'
-parser_registry = subparsers.add_parser('starter', help='')
-parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=True, help='')
-parser_registry.set_defaults(func=starter_box)
-
-# 6.1 python manage.py retrieve
-# 6.2 python manage.py retrieve --name=will
-parser_registry = subparsers.add_parser('retrieve', help='')
-parser_registry.add_argument('-n', '--name', type=verify_name_sandbox, required=False, help='')
-parser_registry.set_defaults(func=retrieve_sandboxes)
-
-
-if len(sys.argv) <= 1:
-    sys.argv.append('--help')
-
-options = parser.parse_args()
-options.func(options, session=None)
+if __name__ == '__main__':
+    main()
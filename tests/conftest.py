@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import manage  # noqa: E402
+
+SETTINGS = """[contexts]
+location = {location}
+pipeline = localhost
+
+[containers]
+location = containers
+boxes = containers/boxes
+
+[repositories]
+location = repositories
+mirrors = mirrors
+token = test
+interval = 0
+
+[profiles]
+location = profiles
+repository =
+
+[environments]
+location = environments
+repository =
+prefix = {location}/conda/envs
+
+[pool]
+size = 0
+"""
+
+
+@pytest.fixture
+def context(tmp_path, monkeypatch):
+    """
+    Throwaway context, manager and terminal of manage.py read its settings
+    """
+    for folder in ('containers/boxes', 'containers/logs', 'repositories', 'mirrors', 'profiles', 'environments', 'conda/envs'):
+        os.makedirs(os.path.join(str(tmp_path), folder))
+    # swept today, the first log of a test does not start a reaper
+    (tmp_path / 'containers' / 'logs' / '.swept').touch()
+    settings = tmp_path / 'settings.ini'
+    settings.write_text(SETTINGS.format(location=tmp_path))
+    monkeypatch.setenv('LOC_DAEMON', '0')
+    monkeypatch.setattr(manage, 'LOC_SETTINGS', str(settings))
+    monkeypatch.setattr(manage, 'manager', manage.Lazy(lambda: manage.ManagerContext(str(settings))))
+    monkeypatch.setattr(manage, 'terminal', manage.Placed(manage.connect_executor))
+    monkeypatch.setattr(manage, 'github', manage.Lazy(manage.connect_github))
+    return tmp_path
+
+
+def git(*args, cwd=None):
+    return subprocess.run(
+        ['git'] + list(args), cwd=cwd, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """
+    :return: factory of local bare repositories with one commit and a tag
+    """
+    def build(name, tag):
+        work = tmp_path / 'work' / name
+        work.mkdir(parents=True)
+        git('init', '--quiet', cwd=work)
+        (work / 'README.md').write_text(name)
+        git('add', '.', cwd=work)
+        git('-c', 'user.name=test', '-c', 'user.email=test@localhost',
+            'commit', '--quiet', '-m', name, cwd=work)
+        git('tag', tag, cwd=work)
+        bare = tmp_path / 'upstream' / name / 'repository.git'
+        git('clone', '--quiet', '--bare', str(work), str(bare))
+        return str(bare)
+    return build
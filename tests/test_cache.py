@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+import pytest
+
+import manage
+
+
+class Terminal(object):
+    def local(self, command, warn=False, hide=None, cwd=None):
+        return manage.Result(command)
+
+
+@pytest.fixture
+def cache(context, monkeypatch):
+    monkeypatch.setattr(manage, 'terminal', Terminal())
+    monkeypatch.setattr(
+        manage, 'export_environment',
+        lambda name, yml, lockfile: open(lockfile, 'w').close()
+    )
+    return manage.EnvironmentCache(str(context / 'cache'), manage.parse_size('20G'))
+
+
+def put(cache, key):
+    cache.put(key, 'box')
+
+
+def test_parallel_processes_keep_every_entry(cache):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=put, args=(cache, 'key{0}'.format(n))) for n in range(8)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [p.exitcode for p in processes] == [0] * 8
+    assert sorted(cache.read()) == sorted('key{0}'.format(n) for n in range(8))
+    assert not [f for f in os.listdir(cache.location) if f.endswith('.tmp')]
+
+
+def test_cache_failure_does_not_fail_the_build(context, cache, monkeypatch):
+    def fail(key, name):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(cache, 'put', fail)
+    # the cache property of the manager answers this cache
+    manage.manager.settings
+    manage.manager.__dict__['_instance']._cache = cache
+    response = manage.conda_build('box', 'python3.6', 'ipython pip')
+    assert response['output']['cache'] == 'miss'
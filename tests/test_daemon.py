@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import manage
+
+MANAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'manage.py')
+
+
+def test_help_without_settings(tmp_path):
+    env = dict(os.environ, LOC_SETTINGS=str(tmp_path / 'nonexistent.ini'))
+    env.pop('LOC_DAEMON', None)
+    for argv in (['--help'], ['create', '--help'], ['retrieve', '-h']):
+        result = subprocess.run(
+            [sys.executable, MANAGE] + argv, env=env, cwd=str(tmp_path),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+        )
+        assert result.returncode == 0, result.stderr
+        assert 'usage:' in result.stdout
+
+
+def test_socket_without_manager(context, monkeypatch):
+    monkeypatch.setattr(manage, 'manager', None)
+    assert manage.daemon_socket() == os.path.join(str(context), 'containers', 'manage.sock')
+    monkeypatch.setattr(manage, 'LOC_SETTINGS', str(context / 'nonexistent.ini'))
+    assert manage.daemon_socket() is None
+    assert manage.forward_daemon(['retrieve']) is None
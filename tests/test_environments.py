@@ -0,0 +1,36 @@
+import os
+
+import yaml
+
+import manage
+
+EXPORT = """name: c1
+channels:
+  - defaults
+dependencies:
+  - ipython=7.16.1=py36h5ca1d4c_0
+  - numpy=1.19.2=py36h54aff64_0
+  - pip=21.2.2=py36h06a4308_0
+  - python=3.6.13=h12debd9_1
+"""
+
+
+def test_sync_spec_keeps_what_create_installed(context):
+    export = context / 'environments' / 'c1.yml'
+    export.write_text(EXPORT)
+    os.makedirs(str(context / 'conda' / 'envs' / 'c1'))
+    repository = context / 'repositories' / 'c1'
+    repository.mkdir()
+    install = {'dirname': str(repository), 'filename': 'requirements.txt', 'installer': 'pip'}
+    spec = manage.generate_yml('c1', 'python3.6', None, install)
+    assert spec.endswith('c1.spec.yml')
+    # the pinned export of create is left as it is
+    assert export.read_text() == EXPORT
+    with open(spec) as infile:
+        dependencies = yaml.safe_load(infile)['dependencies']
+    assert dependencies[:2] == ['python=3.6', 'pip']
+    assert dependencies[3:] == ['ipython', 'numpy']
+    # the next sync keeps them from the previous spec
+    manage.generate_yml('c1', 'python3.6', 'requests', install)
+    with open(spec) as infile:
+        assert yaml.safe_load(infile)['dependencies'][3:] == ['ipython', 'numpy', 'requests']
@@ -0,0 +1,36 @@
+import os
+
+import manage
+from conftest import git
+
+
+def test_clone_modes(context, upstream):
+    url = upstream('full', 'v1')
+    response = manage.git_clone(url, mode='shallow')
+    folder = response['output']['export']
+    assert response['output']['mode'] == 'shallow'
+    assert git('rev-parse', '--is-shallow-repository', cwd=folder) == 'true'
+    # present already, fetched and fast-forwarded
+    response = manage.git_clone(url, mode='shallow')
+    assert response['output']['mode'] == 'fast-forward'
+
+
+def test_clone_borrows_objects_of_the_mirror(context, upstream):
+    url = upstream('borrow', 'v1')
+    response = manage.git_clone(url, mode='full')
+    alternates = os.path.join(response['output']['export'], '.git', 'objects', 'info', 'alternates')
+    assert os.path.isfile(alternates)
+
+
+def test_forks_keep_their_tags_in_the_mirror(context, upstream):
+    first = upstream('r1', 't1')
+    fork = upstream('r2', 't2')
+    mirror = manage.git_mirror(first)
+    assert manage.git_mirror(fork) == mirror
+    tags = git('for-each-ref', '--format=%(refname)', 'refs/remotes/*/tags/*', cwd=mirror).split()
+    assert sorted(t.rsplit('/', 1)[-1] for t in tags) == ['t1', 't2']
+    # fetching the first again does not prune the tag of the fork
+    manage.git_mirror(first)
+    assert len(git('for-each-ref', '--format=%(refname)', 'refs/remotes/*/tags/*', cwd=mirror).split()) == 2
+    assert git('config', 'gc.pruneExpire', cwd=mirror) == 'never'
+    assert git('config', 'gc.auto', cwd=mirror) == '0'
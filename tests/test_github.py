@@ -0,0 +1,140 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import manage
+
+
+class Stand(http.server.BaseHTTPRequestHandler):
+    """
+    Local stand-in of the GitHub API, answers the queued (status, headers)
+    first and then GET /user with an ETag or POST /user/repos
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def answer(self, status, data, headers=()):
+        content = json.dumps(data).encode('utf8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle_request(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.requests.append((method, self.path, dict(self.headers)))
+        if self.server.queue:
+            status, headers = self.server.queue.pop(0)
+            return self.answer(status, {'message': 'queued'}, headers)
+        if method == 'GET' and self.path == '/user':
+            if self.headers.get('If-None-Match') == '"user"':
+                return self.answer(304, None, [('ETag', '"user"')])
+            return self.answer(200, {'login': 'test'}, [('ETag', '"user"')])
+        name = json.loads(body)['name']
+        if name.startswith('taken'):
+            return self.answer(422, {'message': 'name already exists on this account'})
+        self.answer(201, {'name': name, 'clone_url': 'https://github.com/test/{0}.git'.format(name)})
+        if self.server.close:
+            # like a server closing an idle keep-alive connection
+            self.close_connection = True
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Stand)
+    server.daemon_threads = True
+    server.connections, server.requests, server.queue, server.close = 0, [], [], False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(context, server):
+    return manage.GithubClient(
+        'token', 'http://{0}:{1}'.format(*server.server_address),
+        cache=str(context / 'containers' / 'github.json'), interval=0
+    )
+
+
+def test_etag_cache(context, server, client):
+    assert client.user() == {'login': 'test'}
+    # a new client, like the next command, revalidates the cached answer
+    other = manage.GithubClient(
+        'token', 'http://{0}:{1}'.format(*server.server_address),
+        cache=str(context / 'containers' / 'github.json'), interval=0
+    )
+    assert other.user() == {'login': 'test'}
+    assert server.requests[-1][2]['If-None-Match'] == '"user"'
+
+
+def test_keep_alive_and_reopened_connection(server, client):
+    for name in ('a', 'b', 'c'):
+        client.create_repo(name)
+    assert server.connections == 1
+    server.close = True
+    client.create_repo('d')
+    # closed after d, e reopens a connection
+    time.sleep(0.1)
+    assert client.create_repo('e')['name'] == 'e'
+    assert server.connections == 2
+
+
+@pytest.mark.parametrize('status, headers', [
+    (403, [('Retry-After', '0')]),
+    (429, [('Retry-After', '0')]),
+    (403, [('X-RateLimit-Remaining', '0'), ('X-RateLimit-Reset', '0')]),
+])
+def test_rate_limited_requests_wait_and_retry(server, client, status, headers):
+    server.queue.append((status, headers))
+    assert client.create_repo('limited')['name'] == 'limited'
+    assert len(server.requests) == 2
+
+
+def test_waits_for_the_rate_limit_reset(server, client):
+    server.queue.append((403, [('X-RateLimit-Remaining', '0'), ('X-RateLimit-Reset', str(time.time() + 0.5))]))
+    start = time.time()
+    client.create_repo('reset')
+    assert time.time() - start >= 0.5
+
+
+def test_forbidden_without_rate_limit_fails(server, client):
+    server.queue.append((403, []))
+    with pytest.raises(manage.GithubError) as Error:
+        client.create_repo('forbidden')
+    assert Error.value.status == 403
+
+
+def test_create_repos(server, client):
+    repositories = client.create_repos(['one', 'taken1', 'two', 'taken2'])
+    assert repositories['one']['name'] == 'one' and repositories['two']['name'] == 'two'
+    for name in ('taken1', 'taken2'):
+        assert isinstance(repositories[name], manage.GithubError)
+        assert repositories[name].status == 422
+
+
+def test_git_create_raises(context, server, monkeypatch):
+    monkeypatch.setattr(manage, 'github', manage.GithubClient(
+        'token', 'http://{0}:{1}'.format(*server.server_address), interval=0
+    ))
+    with pytest.raises(manage.GithubError, match='422'):
+        manage.git_create('taken')
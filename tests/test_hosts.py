@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+import manage
+
+
+class RemoteExecutor(manage.SubprocessExecutor):
+    """
+    Stand-in for a remote host of [hosts], runs its commands here
+    """
+    remote = True
+
+    def __init__(self, host, commands):
+        super().__init__()
+        self.host = host
+        self.commands = commands
+
+    def local(self, command, warn=False, hide=None, cwd=None):
+        self.commands.append((self.host, command))
+        return super().local(command, warn=warn, hide=hide, cwd=cwd)
+
+
+@pytest.fixture
+def hosts(context, monkeypatch):
+    commands = []
+    monkeypatch.setattr(manage, 'connect_executor', lambda host=None: RemoteExecutor(host, commands))
+    with open(str(context / 'settings.ini'), 'a') as outfile:
+        outfile.write('\n[hosts]\na = 2\nb = 1\n')
+    return commands
+
+
+def test_builds_go_to_the_least_loaded_host(hosts):
+    # built before the threads, like the bulk commands do
+    manage.manager.settings
+    placed, lock = [], threading.Lock()
+
+    def build():
+        with manage.manager.hosts.place() as host:
+            with lock:
+                placed.append(host)
+            time.sleep(0.2)
+
+    threads = [threading.Thread(target=build) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(placed) == ['a', 'a', 'b']
+
+
+def test_hosts_need_a_shared_prefix(hosts):
+    del manage.manager.settings.environments['prefix']
+    with pytest.raises(ValueError, match='prefix'):
+        manage.manager.hosts
+
+
+def test_host_not_seeing_the_prefix(context, hosts):
+    manage.manager.settings.environments['prefix'] = str(context / 'missing')
+    with pytest.raises(ValueError, match='host a does not see'):
+        with manage.manager.hosts.place('a'):
+            pass
+
+
+def test_pip_lock_on_a_remote_host(context, hosts):
+    requirements = context / 'requirements.txt'
+    requirements.write_text('requests\n')
+    with manage.manager.hosts.place() as host:
+        # the conda of the tests does not exist, the resolve fails
+        assert manage.pip_lock('box', '3.6', str(requirements)) is None
+    command = hosts[-1][1]
+    assert command.startswith('{0} run -n base python -m pip install'.format(manage.LOC_CONDA))
+    report = command.split('--report ')[1].split()[0]
+    assert report.startswith(str(context / 'wheelhouse'))
+
+
+def test_hosts_with_user_and_port(context, monkeypatch):
+    commands = []
+    monkeypatch.setattr(manage, 'connect_executor', lambda host=None: RemoteExecutor(host, commands))
+    with open(str(context / 'settings.ini'), 'a') as outfile:
+        outfile.write('\n[hosts]\ndeploy@Build-1:2222 = 3\nBuild-2 = 1\n')
+    assert manage.manager.hosts.hosts == {'deploy@Build-1:2222': 3, 'Build-2': 1}
+    with manage.manager.hosts.place() as host:
+        assert host == 'deploy@Build-1:2222'
+    assert commands[0][0] == 'deploy@Build-1:2222'
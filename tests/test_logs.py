@@ -0,0 +1,34 @@
+import json
+import os
+import time
+
+import manage
+
+
+def test_hidden_commands_keep_no_log(context, monkeypatch):
+    spawned = []
+    monkeypatch.setattr(manage, 'spawn_reaper', lambda: spawned.append(True))
+    os.remove(os.path.join(str(context), 'containers', 'logs', '.swept'))
+    executor = manage.StreamingExecutor()
+    probe = executor.local('git --version', hide=True)
+    shown = executor.local('git --version')
+    failed = executor.local('git config --get nothing.here', warn=True, hide=True)
+    assert probe.log is None
+    assert os.path.isfile(shown.log) and os.path.isfile(failed.log)
+    # the first log of the run asked for a sweep, the next ones did not
+    assert spawned == [True]
+
+
+def test_sweep_old_logs_and_traces(context):
+    logs = os.path.join(str(context), 'containers', 'logs')
+    old, recent = os.path.join(logs, 'old'), os.path.join(logs, 'recent')
+    for folder in (old, recent):
+        os.makedirs(folder)
+    week = time.time() - 8 * 86400
+    os.utime(old, (week, week))
+    with open(manage.tracer.filename, 'w') as outfile:
+        outfile.write(json.dumps({'step': 'old', 'start': week}) + '\n')
+    manage.sweep_logs()
+    assert sorted(e for e in os.listdir(logs) if not e.startswith('.')) == ['recent']
+    assert not os.path.exists(manage.tracer.filename)
+    assert os.path.isfile(manage.tracer.filename + '.1')
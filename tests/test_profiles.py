@@ -0,0 +1,76 @@
+import filecmp
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+import manage
+
+IPython = pytest.importorskip('IPython')
+
+CONDA = """#!{python}
+# conda run -n <env> ipython ... with the ipython of the tests
+import os, sys
+os.execv({python!r}, [{python!r}, '-m', 'IPython'] + sys.argv[5:])
+"""
+
+
+@pytest.fixture
+def profiles(context, monkeypatch):
+    conda = context / 'conda' / 'conda'
+    conda.write_text(CONDA.format(python=sys.executable))
+    conda.chmod(0o755)
+    monkeypatch.setattr(manage, 'LOC_CONDA', str(conda))
+    monkeypatch.setattr(manage, 'ipython_version', lambda name: IPython.__version__)
+    monkeypatch.setenv('IPYTHONDIR', str(context / 'ipython'))
+    return context / 'profiles'
+
+
+def created(context, name):
+    """
+    :return: profile of ipython profile create
+    """
+    reference = context / 'reference'
+    reference.mkdir(exist_ok=True)
+    subprocess.run(
+        [sys.executable, '-m', 'IPython', 'profile', 'create', '[{0}]'.format(name),
+         '--ipython-dir', str(reference)],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return reference / 'profile_[{0}]'.format(name)
+
+
+def assert_identical(left, right):
+    comparison = filecmp.dircmp(str(left), str(right))
+    assert not comparison.left_only and not comparison.right_only
+    for name in comparison.common_files:
+        a, b = os.path.join(str(left), name), os.path.join(str(right), name)
+        with open(a, 'rb') as first, open(b, 'rb') as second:
+            assert first.read() == second.read(), name
+        assert stat.S_IMODE(os.stat(a).st_mode) == stat.S_IMODE(os.stat(b).st_mode), name
+    for name in comparison.common_dirs:
+        assert_identical(os.path.join(str(left), name), os.path.join(str(right), name))
+
+
+def test_rendered_profile_is_identical_to_profile_create(context, profiles):
+    manage.profile_build('box')
+    assert_identical(profiles / 'profile_[box]', created(context, 'box'))
+    # the second box is rendered from the template built by the first
+    manage.profile_build('other')
+    assert_identical(profiles / 'profile_[other]', created(context, 'other'))
+
+
+def test_hardlinked_profiles_copy_their_config(context, profiles):
+    manage.manager.settings.profiles['hardlink'] = 'yes'
+    manage.profile_build('box')
+    template = profiles / '.templates' / 'ipython{0}'.format(IPython.__version__.split('.')[0])
+    for root, dirs, files in os.walk(str(profiles / 'profile_[box]')):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if filename.endswith(('.py', '.json')):
+                assert os.stat(path).st_nlink == 1, path
+    config = profiles / 'profile_[box]' / 'ipython_config.py'
+    config.write_text('edited')
+    assert (template / 'ipython_config.py').read_text() != 'edited'
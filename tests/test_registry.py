@@ -0,0 +1,70 @@
+import glob
+import json
+import os
+
+import pytest
+
+import manage
+
+
+def box(name, _id):
+    return {'_id': _id, 'sandbox': {
+        'name': name,
+        'profile': 'profiles/profile_[{0}]'.format(name),
+        'environment': 'environments/{0}.yml'.format(name),
+        'repository': 'https://github.com/test/{0}.git'.format(name),
+        'location': 'repositories/{0}'.format(name),
+        'version': '3.6',
+        'language': 'python'
+    }}
+
+
+def test_batch_export_removes_its_journal(context, monkeypatch):
+    synced = []
+    monkeypatch.setattr(manage, 'fsync_file', synced.append)
+    monkeypatch.setattr(os, 'sync', lambda: pytest.fail('os.sync flushes every filesystem'))
+    boxes = [box('box{0}'.format(n), n + 1) for n in range(5)]
+    for entry in boxes:
+        manage.manager.registry(entry)
+    responses = manage.manager.export_sandboxes(boxes)
+    assert set(r['status'] for r in responses.values()) == {'successful'}
+    loc_boxes = os.path.join(str(context), 'containers', 'boxes')
+    assert not glob.glob(os.path.join(loc_boxes, '.journal-*'))
+    # the files of the batch are flushed before the journal goes away
+    assert sorted(os.path.basename(f) for f in synced) == ['box{0}.json'.format(n) for n in range(5)]
+    with open(os.path.join(loc_boxes, 'box3.json')) as infile:
+        assert json.load(infile) == boxes[3]
+
+
+def test_name_taken_by_another_process(context):
+    manage.manager.register_sandbox(box('foo', 1))
+    # a second process does not see the box of the first in its table
+    other = manage.ManagerContext(str(context / 'settings.ini'))
+    assert other.registry(box('foo', 2))['status'] == 'successful'
+    with pytest.raises(ValueError, match='name foo belongs to id 1'):
+        other.register_sandbox(box('foo', 2))
+
+
+def test_box_removed_by_another_process(context):
+    manage.manager.register_sandbox(box('d1', 1))
+    # removed by a command that ran in its own process
+    os.remove(os.path.join(str(context), 'containers', 'boxes', 'd1.json'))
+    assert manage.manager.register_sandbox(box('d1', 2))['status'] == 'successful'
+    assert manage.manager.index.get('name', 'd1')['_id'] == 2
+
+
+@pytest.mark.parametrize('argv', [['--sort', 'bogus'], ['--fields', 'name,bogus'], ['-w', '_id=abc'], ['-w', 'bogus=1']])
+def test_retrieve_rejects_before_printing(context, capsys, argv):
+    manage.manager.register_sandbox(box('r1', 1))
+    with pytest.raises(SystemExit):
+        manage.main(['retrieve'] + argv, forward=False)
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert 'bogus' in err or 'abc' in err
+
+
+def test_query_raises_before_iterating(context):
+    with pytest.raises(ValueError, match='not one of'):
+        manage.manager.index.query(sort='bogus')
+    with pytest.raises(ValueError, match='not an integer'):
+        manage.manager.index.query(where=[('_id', '=', 'abc')])
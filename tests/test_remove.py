@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import manage
+from test_registry import box
+
+
+def populate(context, name, prefix):
+    manage.manager.register_sandbox(box(name, abs(hash(name)) % 1000 + 1))
+    for folder in (os.path.join(prefix, name, 'conda-meta'),
+                   os.path.join(str(context), 'repositories', name),
+                   os.path.join(str(context), 'profiles', 'profile_[{0}]'.format(name))):
+        os.makedirs(folder)
+    with open(os.path.join(str(context), 'environments', name + '.yml'), 'w') as outfile:
+        outfile.write('name: {0}\n'.format(name))
+
+
+def remove(**kwargs):
+    args = manage.Args()
+    args.name, args.pattern, args.all, args.wait = None, None, False, True
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    manage.remove_box(args)
+
+
+def test_remove_pattern(context):
+    prefix = os.path.join(str(context), 'conda', 'envs')
+    for name in ('a1', 'a2', 'b1'):
+        populate(context, name, prefix)
+    remove(pattern='a*')
+    assert sorted(os.listdir(prefix)) == ['b1']
+    assert manage.manager.index.names() == ['b1']
+    assert os.listdir(os.path.join(str(context), 'containers', 'trash')) == ['.lock']
+
+
+def test_remove_prefix_on_another_filesystem(context):
+    if not os.path.isdir('/dev/shm') or os.stat('/dev/shm').st_dev == os.stat(str(context)).st_dev:
+        pytest.skip('needs /dev/shm on another filesystem')
+    prefix = tempfile.mkdtemp(dir='/dev/shm')
+    try:
+        manage.manager.settings.environments['prefix'] = prefix
+        populate(context, 'x1', prefix)
+        remove(name='x1')
+        assert os.listdir(prefix) == ['.trash']
+        assert os.listdir(os.path.join(prefix, '.trash')) == []
+        assert not os.path.exists(os.path.join(str(context), 'repositories', 'x1'))
+        assert manage.trash_roots()[1:] == [os.path.join(prefix, '.trash')]
+    finally:
+        shutil.rmtree(prefix)
+
+
+def test_reaper_leaves_what_it_cannot_delete(context, capsys):
+    import subprocess
+    import threading
+    trash = os.path.join(str(context), 'containers', 'trash')
+    stuck = os.path.join(trash, 'stuck-1')
+    readonly = os.path.join(trash, 'readonly-1', 'folder')
+    os.makedirs(stuck)
+    os.makedirs(readonly)
+    open(os.path.join(readonly, 'file'), 'w').close()
+    os.chmod(readonly, 0o500)
+    immutable = os.path.join(stuck, 'file')
+    open(immutable, 'w').close()
+    if subprocess.run(['chattr', '+i', immutable], stderr=subprocess.DEVNULL).returncode:
+        pytest.skip('chattr +i is not supported here')
+    try:
+        reaper = threading.Thread(target=manage.reap_trash)
+        reaper.start()
+        reaper.join(10)
+        assert not reaper.is_alive()
+        assert sorted(e for e in os.listdir(trash) if not e.startswith('.')) == ['stuck-1']
+        assert 'stuck-1 could not be deleted' in capsys.readouterr().err
+    finally:
+        subprocess.run(['chattr', '-i', immutable])
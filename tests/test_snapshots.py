@@ -0,0 +1,35 @@
+import argparse
+import os
+import shutil
+import zipfile
+
+import manage
+from conftest import git
+
+
+def test_snapshot_holds_the_objects_of_the_mirror(context, upstream):
+    url = upstream('borrowed', 'v1')
+    export = manage.git_clone(url, mode='full')['output']['export']
+    assert os.path.isfile(os.path.join(export, '.git', 'objects', 'info', 'alternates'))
+    manage.manager.register_sandbox({'_id': 1, 'sandbox': {
+        'name': 'borrowed',
+        'profile': 'profiles/profile_[borrowed]',
+        'environment': 'environments/borrowed.yml',
+        'repository': url,
+        'location': os.path.relpath(export, str(context)),
+        'version': '3.6',
+        'language': 'python'
+    }})
+    output = str(context / 'borrowed.zip')
+    manage.snapshot_box(argparse.Namespace(name='borrowed', output=output))
+    # another machine, without the mirror
+    shutil.rmtree(str(context / 'mirrors'))
+    restored = context / 'restored'
+    with zipfile.ZipFile(output) as archive:
+        archive.extractall(str(restored))
+    repository = str(restored / 'repository')
+    assert not os.path.exists(os.path.join(repository, '.git', 'objects', 'info', 'alternates'))
+    git('fsck', '--full', cwd=repository)
+    assert git('log', '--format=%s', 'v1', cwd=repository) == 'borrowed'
+    # the box keeps working without its alternates
+    assert git('log', '--format=%s', cwd=export) == 'borrowed'